@@ -0,0 +1,34 @@
+"""Add keyset pagination indexes to api logs
+
+Revision ID: d7a3c91e5b28
+Revises: b4e81d2c6f07
+Create Date: 2026-10-19 12:24:51.907113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a3c91e5b28'
+down_revision: Union[str, Sequence[str], None] = 'b4e81d2c6f07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # api_logs can be big and is written to all the time, so build the indexes
+    # concurrently instead of locking the table (that can't run inside a transaction)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_api_logs_timestamp_utc_id', 'api_logs', ['timestamp_utc', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_api_logs_user_id_timestamp_utc_id', 'api_logs', ['user_id', 'timestamp_utc', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_api_logs_user_id_timestamp_utc_id', table_name='api_logs', postgresql_concurrently=True)
+        op.drop_index('ix_api_logs_timestamp_utc_id', table_name='api_logs', postgresql_concurrently=True)
@@ -1,10 +1,11 @@
 import asyncio
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, desc
 from .database import get_db
 from .models import Log
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
+from .archive import summarize_archive
 
 router = APIRouter(
     prefix="/analytics",
@@ -76,4 +77,13 @@ async def get_analytics(db: AsyncSession = Depends(get_db)):
         "top_endpoints": top_endpoints_res.mappings().all(),
         "top_users": top_users_res.mappings().all(),
         "recent_errors": recent_errors_res.mappings().all()
-    }
\ No newline at end of file
+    }
+
+@router.get("/history")
+async def get_history(start: date, end: date | None = None):
+    # answered from the Parquet archive, the database only holds the last LOG_RETENTION_DAYS
+    end = end or datetime.now(timezone.utc).date()
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start.")
+
+    return await asyncio.to_thread(summarize_archive, start, end)
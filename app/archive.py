@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import Counter
+from datetime import date, datetime, time, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import select, delete, func
+
+from .cache import store
+from .config import (
+    LOG_ARCHIVE_ENABLED, LOG_ARCHIVE_DIR, LOG_RETENTION_DAYS, LOG_ARCHIVE_INTERVAL_SECONDS, LOG_ARCHIVE_CHUNK_ROWS
+)
+from .database import AsyncSessionLocal
+from .models import Log
+
+# Cold storage for api_logs.
+#
+# The dashboard only ever looks at the last 24 hours, so rows older than LOG_RETENTION_DAYS
+# are moved out of PostgreSQL into zstd compressed Parquet files, one directory per UTC day
+# (LOG_ARCHIVE_DIR/date=2026-10-01/part-<id>.parquet, the "hive" layout most tools understand).
+#
+# A day is exported by streaming its rows through a server-side cursor, LOG_ARCHIVE_CHUNK_ROWS
+# at a time, straight into the Parquet writer, so memory use doesn't depend on the size of
+# the day. The file is written under a temporary name, and the rows are only deleted after
+# the row count in the file, in the table and of the DELETE all agree. The DELETE and the
+# rename of the file happen in one transaction: if anything fails the file is removed and
+# the rows stay where they were.
+#
+# Historical aggregates are computed from the files directly (see summarize_archive), one
+# record batch at a time, only reading the columns and day directories a query needs.
+
+ARCHIVE_COLUMNS = ("id", "timestamp_utc", "user_id", "http_method", "request_path", "status_code", "cache_status")
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("timestamp_utc", pa.timestamp("us", tz="UTC")),
+    ("user_id", pa.string()),
+    ("http_method", pa.string()),
+    ("request_path", pa.string()),
+    ("status_code", pa.int16()),
+    ("cache_status", pa.string()),
+])
+DAY_PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+def day_directory(day: date) -> str:
+    return os.path.join(LOG_ARCHIVE_DIR, f"date={day.isoformat()}")
+
+def rows_to_batch(rows) -> pa.RecordBatch:
+    columns = {name: [getattr(row, name) for row in rows] for name in ARCHIVE_COLUMNS}
+    columns["id"] = [str(log_id) for log_id in columns["id"]]
+    return pa.RecordBatch.from_pydict(columns, schema=ARCHIVE_SCHEMA)
+
+def remove_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+async def archive_day(day: date) -> int:
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    in_day = (Log.timestamp_utc >= start) & (Log.timestamp_utc < start + timedelta(days=1))
+
+    directory = day_directory(day)
+    os.makedirs(directory, exist_ok=True)
+    part = f"part-{uuid.uuid4().hex}.parquet"
+    final_path = os.path.join(directory, part)
+    # a leading underscore keeps readers from picking up a half written file
+    temp_path = os.path.join(directory, f"_{part}")
+
+    written = 0
+    async with AsyncSessionLocal() as session:
+        try:
+            query = (
+                select(*(Log.__table__.c[name] for name in ARCHIVE_COLUMNS))
+                .where(in_day)
+                .order_by(Log.timestamp_utc, Log.id)
+                .execution_options(yield_per=LOG_ARCHIVE_CHUNK_ROWS)
+            )
+            with pq.ParquetWriter(temp_path, ARCHIVE_SCHEMA, compression="zstd") as writer:
+                result = await session.stream(query)
+                async for rows in result.partitions():
+                    # compressing a chunk is CPU work, keep it off the event loop
+                    await asyncio.to_thread(writer.write_batch, rows_to_batch(rows))
+                    written += len(rows)
+
+            if written == 0:
+                remove_file(temp_path)
+                if not os.listdir(directory):
+                    os.rmdir(directory)
+                return 0
+
+            in_file = pq.ParquetFile(temp_path).metadata.num_rows
+            in_table = await session.scalar(select(func.count()).select_from(Log).where(in_day))
+            if not written == in_file == in_table:
+                raise RuntimeError(f"wrote {written} rows, file has {in_file}, table has {in_table}")
+
+            deleted = (await session.execute(delete(Log).where(in_day))).rowcount
+            if deleted != written:
+                raise RuntimeError(f"wrote {written} rows but would delete {deleted}")
+
+            os.replace(temp_path, final_path)
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            remove_file(temp_path)
+            remove_file(final_path)
+            raise
+
+    return written
+
+async def archive_old_logs() -> int:
+    cutoff_day = datetime.now(timezone.utc).date() - timedelta(days=LOG_RETENTION_DAYS)
+    cutoff = datetime.combine(cutoff_day, time.min, tzinfo=timezone.utc)
+
+    async with AsyncSessionLocal() as session:
+        oldest = await session.scalar(select(func.min(Log.timestamp_utc)).where(Log.timestamp_utc < cutoff))
+    if oldest is None:
+        return 0
+
+    if oldest.tzinfo is not None:
+        oldest = oldest.astimezone(timezone.utc)
+
+    archived = 0
+    day = oldest.date()
+    while day < cutoff_day:
+        count = await archive_day(day)
+        if count:
+            logging.info(f"Archived {count} logs from {day.isoformat()}.")
+        archived += count
+        day += timedelta(days=1)
+    return archived
+
+async def log_archiver():
+    if not LOG_ARCHIVE_ENABLED:
+        return
+
+    while True:
+        await asyncio.sleep(LOG_ARCHIVE_INTERVAL_SECONDS)
+        # one worker archives per interval, the others skip this round
+        if not await store.acquire_lock("log_archiver_lock", LOG_ARCHIVE_INTERVAL_SECONDS):
+            continue
+        try:
+            await archive_old_logs()
+        except Exception as e:
+            logging.error(f"Log archival failed, the rows stay in the database: {e}", exc_info=True)
+
+def summarize_archive(start: date, end: date, top: int = 5) -> dict:
+    """Aggregates archived logs between two days (inclusive). Blocking, run it in a thread."""
+    total_requests = 0
+    per_day = Counter()
+    status_codes = Counter()
+    endpoints = Counter()
+    users = Counter()
+
+    if os.path.isdir(LOG_ARCHIVE_DIR):
+        dataset = ds.dataset(LOG_ARCHIVE_DIR, format="parquet", partitioning=DAY_PARTITIONING)
+        day_filter = (ds.field("date") >= start.isoformat()) & (ds.field("date") <= end.isoformat())
+        batches = dataset.to_batches(columns=["date", "status_code", "request_path", "user_id"], filter=day_filter)
+
+        for batch in batches:
+            for column, counter in (("date", per_day), ("status_code", status_codes),
+                                    ("request_path", endpoints), ("user_id", users)):
+                for item in pc.value_counts(batch.column(column)).to_pylist():
+                    counter[item["values"]] += item["counts"]
+            total_requests += batch.num_rows
+
+    status_code_counts = {"2xx": 0, "4xx": 0, "5xx": 0}
+    for code, count in status_codes.items():
+        if 200 <= code < 300:
+            status_code_counts["2xx"] += count
+        elif 400 <= code < 500:
+            status_code_counts["4xx"] += count
+        elif 500 <= code < 600:
+            status_code_counts["5xx"] += count
+
+    successful_requests = sum(count for code, count in status_codes.items() if code < 400)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total_requests": total_requests,
+        "successful_requests": successful_requests,
+        "total_errors": total_requests - successful_requests,
+        "status_code_counts": status_code_counts,
+        "requests_per_day": [{"day": day, "count": count} for day, count in sorted(per_day.items())],
+        "top_endpoints": [{"request_path": path, "count": count} for path, count in endpoints.most_common(top)],
+        "top_users": [{"user_id": user, "count": count} for user, count in users.most_common(top)],
+    }
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, status
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .database import get_db
-from .security import create_api_key
+from .database import AsyncSessionLocal, get_db
+from .security import create_api_key, create_api_keys, require_admin_token
+from .config import PRIORITY_TIERS, DEFAULT_PRIORITY_TIER, KEY_BATCH_MAX_KEYS, KEY_BATCH_CHUNK_SIZE
 
 from pydantic import BaseModel
 
@@ -12,6 +16,16 @@ class APIKeyCreateRequest(BaseModel):
 class APIKeyCreateResponse(BaseModel):
     api_key: str
 
+class APIKeyBatchItem(BaseModel):
+    user_id: str
+    count: int = 1
+    requests_per_minute: int = 100
+    expires_days: int | None = 30
+    priority: str = DEFAULT_PRIORITY_TIER
+
+class APIKeyBatchRequest(BaseModel):
+    keys: list[APIKeyBatchItem]
+
 router = APIRouter(
     prefix="/auth", 
     tags=["Authentication"]
@@ -22,5 +36,38 @@ async def generate_new_api_key(
     request_data: APIKeyCreateRequest,
     db: AsyncSession = Depends(get_db)
 ):
+    # self-service keys always get the default tier, only /keys/batch (admin) can set another
     new_key = await create_api_key(db=db, user_id=request_data.user_id)
     return {"api_key": new_key}
+
+async def provision_keys(specs: list[dict]):
+    # each chunk is hashed, inserted and committed before its keys are sent, so a client
+    # that gets cut off mid-stream still holds only keys that really exist
+    async with AsyncSessionLocal() as db:
+        for start in range(0, len(specs), KEY_BATCH_CHUNK_SIZE):
+            created = await create_api_keys(db, specs[start:start + KEY_BATCH_CHUNK_SIZE])
+            yield "".join(json.dumps(key) + "\n" for key in created)
+
+@router.post("/keys/batch", dependencies=[Depends(require_admin_token)])
+async def generate_api_keys_batch(request_data: APIKeyBatchRequest):
+    total = sum(item.count for item in request_data.keys)
+    if total < 1 or total > KEY_BATCH_MAX_KEYS:
+        raise HTTPException(status_code=400, detail=f"A batch must create between 1 and {KEY_BATCH_MAX_KEYS} keys.")
+
+    for item in request_data.keys:
+        if item.count < 0 or item.requests_per_minute < 1:
+            raise HTTPException(status_code=400, detail="count and requests_per_minute must be positive.")
+        if item.priority not in PRIORITY_TIERS:
+            raise HTTPException(status_code=400, detail="Unknown priority tier.")
+
+    specs = [
+        {
+            "user_id": item.user_id,
+            "requests_per_minute": item.requests_per_minute,
+            "expires_days": item.expires_days,
+            "priority": item.priority,
+        }
+        for item in request_data.keys
+        for _ in range(item.count)
+    ]
+    return StreamingResponse(provision_keys(specs), media_type="application/x-ndjson")
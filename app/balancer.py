@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import math
+import random
+import time
+
+from fastapi import APIRouter, Depends
+from httpx import AsyncClient, TransportError
+
+from .resilience import HEDGE_LOST
+from .security import require_admin_token
+from .config import (
+    LOAD_BALANCING_STRATEGY, BREAKER_FAILURE_STATUSES,
+    EWMA_DECAY_SECONDS, EWMA_DEFAULT_RTT_SECONDS, EJECTION_CONSECUTIVE_FAILURES, EJECTION_SECONDS,
+    HEALTH_CHECK_INTERVAL_SECONDS, HEALTH_CHECK_TIMEOUT_SECONDS
+)
+
+# Spreads each API target over one or more upstream instances.
+#
+# Strategies:
+#   round_robin        - smooth weighted round-robin over a schedule precomputed from the
+#                        weights, so picking the next instance is just advancing a cursor
+#                        (weights only apply to this strategy)
+#   least_outstanding  - "power of two choices": sample two instances at random and take the
+#                        one with fewer requests in flight
+#   peak_ewma          - same two-choice sampling, scored by a latency EWMA that jumps up
+#                        immediately on a slow response and decays slowly, times load
+#
+# Sampling two instances instead of scanning all of them keeps selection O(1) no matter
+# how many replicas a target has, and avoids every worker herding onto the same "best" one.
+#
+# Instances are taken out of rotation passively after EJECTION_CONSECUTIVE_FAILURES failed
+# requests, and actively when their target's health check path stops answering.
+#
+# The pools themselves are built by the routing table (see routing.py) and swapped in
+# whenever it reloads.
+
+STRATEGIES = ("round_robin", "least_outstanding", "peak_ewma")
+
+# admin only, like /routes: it lists the internal URL of every upstream instance
+router = APIRouter(
+    prefix="/upstreams",
+    tags=["Upstreams"],
+    dependencies=[Depends(require_admin_token)]
+)
+
+class Endpoint:
+    def __init__(self, url: str, weight: int = 1):
+        self.url = url
+        self.weight = weight
+        self.outstanding = 0
+        self.ewma = EWMA_DEFAULT_RTT_SECONDS
+        self.ewma_updated_at = time.monotonic()
+        self.healthy = True
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.selections = 0
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.ejected_until
+
+    def observe_latency(self, seconds: float, now: float):
+        # peak EWMA: a slow response counts in full straight away, fast ones pull the
+        # estimate down gradually, weighted by how long since the last sample
+        if seconds > self.ewma:
+            self.ewma = seconds
+        else:
+            decay = math.exp(-(now - self.ewma_updated_at) / EWMA_DECAY_SECONDS)
+            self.ewma = self.ewma * decay + seconds * (1 - decay)
+        self.ewma_updated_at = now
+
+    def ewma_cost(self) -> float:
+        return self.ewma * (self.outstanding + 1)
+
+    def stats(self, now: float) -> dict:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "ejected": now < self.ejected_until,
+            "outstanding": self.outstanding,
+            "ewma_ms": round(self.ewma * 1000, 2),
+            "selections": self.selections,
+            "failures": self.failures,
+        }
+
+def parse_endpoints(upstreams, previous: list[Endpoint] | None = None) -> list[Endpoint]:
+    # upstreams is a base URL, or a list of base URLs / {"url": ..., "weight": ...} dicts.
+    # Instances that already existed keep their state, so a reload doesn't reset
+    # their latency estimates or un-eject them.
+    if isinstance(upstreams, str):
+        upstreams = [upstreams]
+
+    existing = {endpoint.url: endpoint for endpoint in previous or []}
+    endpoints = []
+    for item in upstreams:
+        if isinstance(item, str):
+            item = {"url": item}
+        url = item["url"].rstrip("/")
+        weight = item.get("weight", 1)
+        endpoint = existing.get(url)
+        if endpoint is None:
+            endpoint = Endpoint(url, weight)
+        endpoint.weight = weight
+        endpoints.append(endpoint)
+    return endpoints
+
+def smooth_weighted_schedule(weights: list[int]) -> list[int]:
+    # nginx's smooth weighted round-robin, run once for a full cycle so that
+    # heavy instances are interleaved with the others instead of bunched together
+    current = [0] * len(weights)
+    total = sum(weights)
+    schedule = []
+    for _ in range(total):
+        for i, weight in enumerate(weights):
+            current[i] += weight
+        best = max(range(len(weights)), key=lambda i: current[i])
+        current[best] -= total
+        schedule.append(best)
+    return schedule
+
+class UpstreamPool:
+    def __init__(self, api_name: str, endpoints: list[Endpoint], strategy: str, health_path: str | None = None):
+        self.api_name = api_name
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.health_path = health_path
+        self.schedule = smooth_weighted_schedule([endpoint.weight for endpoint in endpoints])
+        self.cursor = 0
+
+    def _round_robin(self, now: float) -> Endpoint | None:
+        # only walks past unavailable instances, so this is O(1) while the pool is healthy
+        for _ in range(len(self.schedule)):
+            endpoint = self.endpoints[self.schedule[self.cursor]]
+            self.cursor = (self.cursor + 1) % len(self.schedule)
+            if endpoint.available(now):
+                return endpoint
+        return None
+
+    def _two_choices(self, now: float) -> Endpoint | None:
+        first, second = random.sample(self.endpoints, 2)
+        candidates = [endpoint for endpoint in (first, second) if endpoint.available(now)]
+        if not candidates:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+            if not candidates:
+                return None
+            return candidates[0] if len(candidates) == 1 else self._pick(*random.sample(candidates, 2))
+        if len(candidates) == 1:
+            return candidates[0]
+        return self._pick(*candidates)
+
+    def _pick(self, first: Endpoint, second: Endpoint) -> Endpoint:
+        if self.strategy == "peak_ewma":
+            return first if first.ewma_cost() <= second.ewma_cost() else second
+        return first if first.outstanding <= second.outstanding else second
+
+    def select(self) -> Endpoint:
+        if len(self.endpoints) == 1:
+            endpoint = self.endpoints[0]
+        else:
+            now = time.monotonic()
+            if self.strategy == "round_robin":
+                endpoint = self._round_robin(now)
+            else:
+                endpoint = self._two_choices(now)
+            # every instance is out of rotation: rather than failing every request,
+            # keep sending traffic and let the circuit breaker decide
+            if endpoint is None:
+                endpoint = self.endpoints[self.cursor % len(self.endpoints)]
+                self.cursor += 1
+
+        endpoint.selections += 1
+        return endpoint
+
+    def record_result(self, endpoint: Endpoint, seconds: float, failed: bool, timed_out: bool = False):
+        now = time.monotonic()
+        if failed:
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if timed_out:
+                # there's no response time for a hang, but it took at least this long
+                endpoint.observe_latency(seconds, now)
+            if endpoint.consecutive_failures >= EJECTION_CONSECUTIVE_FAILURES and len(self.endpoints) > 1:
+                if now >= endpoint.ejected_until:
+                    logging.warning(f"Ejecting {endpoint.url} from {self.api_name} for {EJECTION_SECONDS}s.")
+                endpoint.ejected_until = now + EJECTION_SECONDS
+        else:
+            endpoint.consecutive_failures = 0
+            endpoint.observe_latency(seconds, now)
+
+    async def dispatch(self, send):
+        """Picks an instance and runs `send(base_url)` against it, tracking load and latency."""
+        endpoint = self.select()
+        endpoint.outstanding += 1
+        start = time.monotonic()
+        failed = None
+        timed_out = False
+        try:
+            response, content = await send(endpoint.url)
+            failed = response.status_code in BREAKER_FAILURE_STATUSES
+            return response, content
+        except TransportError:
+            failed = True
+            raise
+        except asyncio.CancelledError as e:
+            # cancelled while the instance was still on it: the timeout budget ran out, which
+            # is the instance's fault. Losing a hedge race to another attempt is not.
+            if HEDGE_LOST not in e.args:
+                failed = timed_out = True
+            raise
+        finally:
+            endpoint.outstanding -= 1
+            if failed is not None:
+                self.record_result(endpoint, time.monotonic() - start, failed, timed_out)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "strategy": self.strategy,
+            "endpoints": [endpoint.stats(now) for endpoint in self.endpoints]
+        }
+
+def build_pools(targets: dict, previous: dict[str, UpstreamPool] | None = None) -> dict[str, UpstreamPool]:
+    previous = previous or {}
+    built = {}
+    for api_name, target in targets.items():
+        old_pool = previous.get(api_name)
+        built[api_name] = UpstreamPool(
+            api_name,
+            parse_endpoints(target["upstreams"], old_pool.endpoints if old_pool else None),
+            target.get("strategy") or LOAD_BALANCING_STRATEGY,
+            target.get("health_path")
+        )
+    return built
+
+pools: dict[str, UpstreamPool] = {}
+
+def set_pools(new_pools: dict[str, UpstreamPool]):
+    global pools
+    pools = new_pools
+
+def get_pool(api_name: str) -> UpstreamPool | None:
+    return pools.get(api_name)
+
+async def check_endpoint(client: AsyncClient, endpoint: Endpoint, health_path: str):
+    try:
+        response = await client.get(f"{endpoint.url}{health_path}", timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+        healthy = response.status_code < 500
+    except TransportError:
+        healthy = False
+    except Exception as e:
+        # e.g. a URL httpx won't build, which no retry will fix, so say why
+        logging.error(f"Health check of {endpoint.url} failed: {e!r}")
+        healthy = False
+
+    if healthy != endpoint.healthy:
+        logging.warning(f"Upstream {endpoint.url} is now {'healthy' if healthy else 'unhealthy'}.")
+    endpoint.healthy = healthy
+
+async def health_check_loop():
+    async with AsyncClient() as client:
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
+            try:
+                checks = [
+                    check_endpoint(client, endpoint, pool.health_path)
+                    for pool in pools.values() if pool.health_path
+                    for endpoint in pool.endpoints
+                ]
+                if checks:
+                    await asyncio.gather(*checks)
+            except Exception as e:
+                # keep checking, otherwise an instance marked unhealthy would never come back
+                logging.error(f"Health check round failed: {e}", exc_info=True)
+
+async def warm_endpoint(client: AsyncClient, endpoint: Endpoint, health_path: str | None):
+    try:
+        # any answer will do, what we're after is the pooled keep-alive connection
+        await client.head(f"{endpoint.url}{health_path or '/'}", timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+    except TransportError as e:
+        logging.warning(f"Could not open a connection to {endpoint.url}: {e!r}")
+
+async def warm_upstream_connections(client: AsyncClient, per_endpoint: int):
+    # sent concurrently, so each one opens a connection of its own
+    await asyncio.gather(*(
+        warm_endpoint(client, endpoint, pool.health_path)
+        for pool in pools.values()
+        for endpoint in pool.endpoints
+        for _ in range(per_endpoint)
+    ))
+
+@router.get("/")
+async def get_upstream_stats():
+    return {api_name: pool.stats() for api_name, pool in pools.items()}
@@ -1,18 +1,307 @@
 import redis.asyncio as redis
 import json
-from .config import REDIS_URL, CACHE_EXPIRY_SECONDS
+import time
+from collections import OrderedDict
+from .config import (
+    REDIS_URL, BACKEND, CACHE_EXPIRY_SECONDS, CACHE_LOCAL_MAX_ENTRIES, CACHE_LOCAL_TTL_SECONDS, CACHE_MEMORY_MAX_BYTES
+)
 
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
+# cache entries hold raw (possibly compressed) bodies, so they need a client that doesn't decode
+cache_client = redis.from_url(REDIS_URL)
+
+# Entries are stored as a single string: a format marker, one line of JSON metadata
+# (status code, headers, content encoding) and then the body bytes exactly as they
+# should be sent. Keeping the body out of the JSON avoids base64 bloat for compressed data.
+CACHE_FORMAT_MARKER = b"RX1\n"
+
+# every cached response lives under this prefix, nothing else in Redis does
+CACHE_KEY_PREFIX = "cache:"
+
+def make_cache_key(api_name: str, path: str, query_params: dict) -> str:
+    serialized_query_parameters = json.dumps(query_params, sort_keys=True)
+    return f"{CACHE_KEY_PREFIX}{api_name}:{path}:{serialized_query_parameters}"
+
+def decode_cache_entry(result: bytes) -> dict:
+    if result.startswith(CACHE_FORMAT_MARKER):
+        metadata, body = result[len(CACHE_FORMAT_MARKER):].split(b"\n", 1)
+        entry = json.loads(metadata)
+        entry["body"] = body
+        return entry
+
+    # entries written before the binary format stored the parsed JSON content
+    legacy_entry = json.loads(result)
+    headers = legacy_entry["headers"]
+    for header in ("content-encoding", "content-length", "transfer-encoding"):
+        headers.pop(header, None)
+    return {
+        "status_code": legacy_entry["status_code"],
+        "headers": headers,
+        "encoding": "identity",
+        "body": json.dumps(legacy_entry["content"]).encode()
+    }
+
+def encode_cache_entry(entry: dict) -> bytes:
+    metadata = {
+        "status_code": entry["status_code"],
+        "headers": entry["headers"],
+        "encoding": entry["encoding"]
+    }
+    # the request that produced the entry, so it can be refreshed before it expires
+    if entry.get("source"):
+        metadata["source"] = entry["source"]
+    if entry.get("negative"):
+        metadata["negative"] = True
+    return CACHE_FORMAT_MARKER + json.dumps(metadata).encode() + b"\n" + entry["body"]
+
+# Every entry is also recorded in index sets, so purges (see invalidation.py) can find the
+# keys to delete without SCANning the whole keyspace:
+#   cache_index:path:{api_name}:{prefix}  one per path level, "" covers the whole API
+#   cache_index:tag:{tag}                 one per surrogate tag on the response
+#   cache_index:negative:{api_name}:{path} negatively cached entries (errors, 404s) of a path
+# The sets are sorted sets scored by when the entry expires. Each write trims members that
+# have already expired, so an index never holds much more than the live entries, and the
+# index key itself lives as long as its longest-lived entry.
+
+def index_path_prefixes(path: str) -> list[str]:
+    segments = [segment for segment in path.split("/") if segment]
+    return ["/".join(segments[:depth]) for depth in range(len(segments) + 1)]
+
+def path_index_key(api_name: str, prefix: str) -> str:
+    return f"cache_index:path:{api_name}:{prefix.strip('/')}"
+
+def tag_index_key(tag: str) -> str:
+    return f"cache_index:tag:{tag}"
+
+def negative_index_key(api_name: str, path: str) -> str:
+    return f"cache_index:negative:{api_name}:{path.strip('/')}"
+
+# Per-worker copies of recently read entries, kept for a few seconds at most and
+# dropped as soon as a purge is announced. Disabled unless CACHE_LOCAL_MAX_ENTRIES is set.
+local_cache: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+def remember_locally(cache_key: str, result: bytes):
+    local_cache[cache_key] = (time.monotonic() + CACHE_LOCAL_TTL_SECONDS, result)
+    local_cache.move_to_end(cache_key)
+    if len(local_cache) > CACHE_LOCAL_MAX_ENTRIES:
+        local_cache.popitem(last=False)
+
+def forget_locally(cache_keys=None):
+    if cache_keys is None:
+        local_cache.clear()
+        return
+    for cache_key in cache_keys:
+        local_cache.pop(cache_key, None)
+
+# Where entries and their indexes live. The Redis store is shared by every worker; the
+# memory store keeps everything in this process for single-node deployments (BACKEND =
+# "memory"), where a Redis round trip per request buys nothing. Both expose the same
+# handful of operations, and everything else in the gateway goes through `store`.
+
+class RedisCacheStore:
+    async def get(self, key: str) -> bytes | None:
+        return await cache_client.get(key)
+
+    async def get_many(self, keys: list[str]) -> list:
+        return await cache_client.mget(keys)
+
+    async def exists(self, key: str) -> bool:
+        return bool(await cache_client.exists(key))
+
+    async def ttls_ms(self, keys: list[str]) -> list[int]:
+        pipe = cache_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.pttl(key)
+        return await pipe.execute()
+
+    async def set(self, key: str, value: bytes, ttl: int, index_keys: list[str], now: float,
+                  unindex_keys: list[str] = ()):
+        if not index_keys and not unindex_keys:
+            await cache_client.setex(key, ttl, value)
+            return
+
+        pipe = cache_client.pipeline(transaction=False)
+        pipe.setex(key, ttl, value)
+        for index_key in unindex_keys:
+            pipe.zrem(index_key, key)
+        for index_key in index_keys:
+            pipe.zremrangebyscore(index_key, "-inf", now)
+            pipe.zadd(index_key, {key: now + ttl})
+            # NX gives a new index a TTL, GT only ever extends an existing one
+            pipe.expire(index_key, ttl, nx=True)
+            pipe.expire(index_key, ttl, gt=True)
+        await pipe.execute()
+
+    async def delete(self, keys: list[str]) -> int:
+        return await cache_client.unlink(*keys)
+
+    async def index_members(self, index_key: str, min_score, count: int) -> list[str]:
+        members = await cache_client.zrangebyscore(index_key, min_score, "+inf", start=0, num=count)
+        return [member.decode() for member in members]
+
+    async def delete_indexed(self, index_key: str, keys: list[str]) -> int:
+        pipe = cache_client.pipeline(transaction=False)
+        pipe.unlink(*keys)
+        pipe.zrem(index_key, *keys)
+        deleted, _ = await pipe.execute()
+        return deleted
+
+    async def publish(self, channel: str, message: str):
+        await redis_client.publish(channel, message)
+
+    async def acquire_lock(self, name: str, ttl: int) -> bool:
+        return bool(await redis_client.set(name, 1, nx=True, ex=ttl))
+
+class MemoryCacheStore:
+    SWEEP_INTERVAL_SECONDS = 60
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # least recently used first, evicted once the bodies add up to more than max_bytes
+        self.entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self.indexes: dict[str, dict[str, float]] = {}
+        self.locks: dict[str, float] = {}
+        self.next_sweep = 0.0
+
+    def _drop(self, key: str):
+        _, value = self.entries.pop(key)
+        self.size -= len(value)
+
+    def _live(self, key: str, now: float) -> tuple[float, bytes] | None:
+        item = self.entries.get(key)
+        if item is not None and item[0] <= now:
+            self._drop(key)
+            return None
+        return item
+
+    def _sweep(self, now: float):
+        # expired entries and index members would otherwise only go when touched again
+        for key in [key for key, (expires_at, _) in self.entries.items() if expires_at <= now]:
+            self._drop(key)
+        for index_key in list(self.indexes):
+            index = self.indexes[index_key]
+            for member in [member for member, score in index.items() if score <= now]:
+                del index[member]
+            if not index:
+                del self.indexes[index_key]
+        self.next_sweep = now + self.SWEEP_INTERVAL_SECONDS
+
+    async def get(self, key: str) -> bytes | None:
+        item = self._live(key, time.time())
+        if item is None:
+            return None
+        self.entries.move_to_end(key)
+        return item[1]
+
+    async def get_many(self, keys: list[str]) -> list:
+        return [await self.get(key) for key in keys]
+
+    async def exists(self, key: str) -> bool:
+        return self._live(key, time.time()) is not None
+
+    async def ttls_ms(self, keys: list[str]) -> list[int]:
+        now = time.time()
+        ttls = []
+        for key in keys:
+            item = self._live(key, now)
+            ttls.append(-2 if item is None else int((item[0] - now) * 1000))
+        return ttls
+
+    async def set(self, key: str, value: bytes, ttl: int, index_keys: list[str], now: float,
+                  unindex_keys: list[str] = ()):
+        if now >= self.next_sweep:
+            self._sweep(now)
+
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (now + ttl, value)
+        self.size += len(value)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self._drop(next(iter(self.entries)))
+
+        for index_key in index_keys:
+            self.indexes.setdefault(index_key, {})[key] = now + ttl
+        for index_key in unindex_keys:
+            index = self.indexes.get(index_key)
+            if index is not None:
+                index.pop(key, None)
+                if not index:
+                    del self.indexes[index_key]
+
+    async def delete(self, keys: list[str]) -> int:
+        deleted = 0
+        for key in keys:
+            if key in self.entries:
+                self._drop(key)
+                deleted += 1
+        return deleted
+
+    async def index_members(self, index_key: str, min_score, count: int) -> list[str]:
+        min_score = float(min_score)
+        index = self.indexes.get(index_key, {})
+        members = []
+        for member, score in index.items():
+            if score >= min_score:
+                members.append(member)
+                if len(members) == count:
+                    break
+        return members
+
+    async def delete_indexed(self, index_key: str, keys: list[str]) -> int:
+        index = self.indexes.get(index_key, {})
+        for key in keys:
+            index.pop(key, None)
+        if not index:
+            self.indexes.pop(index_key, None)
+        return await self.delete(keys)
+
+    async def publish(self, channel: str, message: str):
+        # nobody else to tell, this process holds the only copy
+        pass
+
+    async def acquire_lock(self, name: str, ttl: int) -> bool:
+        now = time.monotonic()
+        if self.locks.get(name, 0.0) > now:
+            return False
+        self.locks[name] = now + ttl
+        return True
+
+store = MemoryCacheStore(CACHE_MEMORY_MAX_BYTES) if BACKEND == "memory" else RedisCacheStore()
+
 async def get_cached_response(cache_key: str):
-    result = await redis_client.get(cache_key)
+    if CACHE_LOCAL_MAX_ENTRIES:
+        local = local_cache.get(cache_key)
+        if local is not None and local[0] > time.monotonic():
+            return decode_cache_entry(local[1])
+
+    result = await store.get(cache_key)
 
     if result is not None:
-        return json.loads(result)
+        if CACHE_LOCAL_MAX_ENTRIES:
+            remember_locally(cache_key, result)
+        return decode_cache_entry(result)
     return None
 
-async def set_cached_response(cache_key: str, response_data: dict):
-    json_response = json.dumps(response_data)
-    
-    await redis_client.setex(cache_key, CACHE_EXPIRY_SECONDS, json_response)
+async def set_cached_response(
+    cache_key: str,
+    entry: dict,
+    ttl: int = CACHE_EXPIRY_SECONDS,
+    api_name: str | None = None,
+    path: str | None = None,
+    tags=()
+):
+    now = time.time()
+    index_keys = [tag_index_key(tag) for tag in tags]
+    unindex_keys = []
+    if api_name is not None:
+        index_keys += [path_index_key(api_name, prefix) for prefix in index_path_prefixes(path or "")]
+        # a good answer may replace a negative one, which must then leave the negative index
+        # or the next negative purge for the path would delete the good entry
+        if entry.get("negative"):
+            index_keys.append(negative_index_key(api_name, path or ""))
+        else:
+            unindex_keys.append(negative_index_key(api_name, path or ""))
 
+    await store.set(cache_key, encode_cache_entry(entry), ttl, index_keys, now, unindex_keys)
@@ -0,0 +1,125 @@
+import gzip
+import zlib
+from .config import COMPRESSION_MIN_SIZE, CACHE_COMPRESSION_CODEC, CACHE_COMPRESSION_THRESHOLD
+
+# brotli and zstd are optional, we only advertise and use them when the libraries are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+IDENTITY = "identity"
+
+COMPRESSIBLE_TYPES = ("json", "text/", "xml", "javascript")
+
+def _inflate(data: bytes) -> bytes:
+    # "deflate" is supposed to be zlib wrapped, but some servers send raw deflate streams
+    try:
+        return zlib.decompress(data)
+    except zlib.error:
+        return zlib.decompress(data, -zlib.MAX_WBITS)
+
+CODECS = {
+    "gzip": (lambda data: gzip.compress(data, compresslevel=6), gzip.decompress),
+    "deflate": (lambda data: zlib.compress(data, 6), _inflate),
+}
+
+if brotli is not None:
+    CODECS["br"] = (lambda data: brotli.compress(data, quality=5), brotli.decompress)
+
+if zstandard is not None:
+    CODECS["zstd"] = (
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    )
+
+# sent upstream instead of the client's own header, the cached copy is shared by every
+# client so we ask for anything we know how to decode
+UPSTREAM_ACCEPT_ENCODING = ", ".join(CODECS)
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return CODECS[encoding][0](data)
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == IDENTITY:
+        return data
+    return CODECS[encoding][1](data)
+
+def is_supported(encoding: str) -> bool:
+    return encoding == IDENTITY or encoding in CODECS
+
+def is_compressible(content_type: str | None) -> bool:
+    if not content_type:
+        return False
+    return any(marker in content_type for marker in COMPRESSIBLE_TYPES)
+
+def parse_accept_encoding(header: str | None) -> dict:
+    accepted = {}
+    if not header:
+        return accepted
+
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+
+    return accepted
+
+def client_accepts(accepted: dict, encoding: str) -> bool:
+    if encoding == IDENTITY:
+        return True
+    quality = accepted.get(encoding, accepted.get("*", 0.0))
+    return quality > 0
+
+def negotiate_encoding(accepted: dict) -> str | None:
+    # prefer the cache codec so entries stored compressed can be passed straight through
+    if client_accepts(accepted, CACHE_COMPRESSION_CODEC) and CACHE_COMPRESSION_CODEC in CODECS:
+        return CACHE_COMPRESSION_CODEC
+
+    candidates = [(q, name) for name, q in accepted.items() if name in CODECS and q > 0]
+    if not candidates:
+        return None
+    return max(candidates)[1]
+
+def compress_for_cache(body: bytes, encoding: str, content_type: str | None) -> tuple[bytes, str]:
+    # upstream already compressed it, store those exact bytes
+    if encoding != IDENTITY:
+        return body, encoding
+
+    if CACHE_COMPRESSION_CODEC not in CODECS:
+        return body, encoding
+
+    if len(body) >= CACHE_COMPRESSION_THRESHOLD and is_compressible(content_type):
+        return compress(body, CACHE_COMPRESSION_CODEC), CACHE_COMPRESSION_CODEC
+    return body, encoding
+
+def encode_for_client(body: bytes, encoding: str, accept_encoding: str | None, content_type: str | None) -> tuple[bytes, str]:
+    accepted = parse_accept_encoding(accept_encoding)
+
+    # the cheap path: the client understands what we already have, no decompress/recompress
+    if client_accepts(accepted, encoding):
+        if encoding != IDENTITY or len(body) < COMPRESSION_MIN_SIZE or not is_compressible(content_type):
+            return body, encoding
+
+    body = decompress(body, encoding)
+
+    if len(body) >= COMPRESSION_MIN_SIZE and is_compressible(content_type):
+        target = negotiate_encoding(accepted)
+        if target is not None:
+            return compress(body, target), target
+
+    return body, IDENTITY
@@ -0,0 +1,128 @@
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import redis.asyncio as redis
+from fastapi import HTTPException, status
+
+from .config import (
+    REDIS_URL, BACKEND, MAX_CONCURRENT_REQUESTS_PER_KEY, CONCURRENCY_LEASE_MARGIN_SECONDS,
+    CONCURRENCY_QUEUE_TIMEOUT_SECONDS, CONCURRENCY_RETRY_INTERVAL_SECONDS
+)
+
+redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+
+# Distributed limit on requests *in flight*, next to the rate limiter which only counts starts.
+#
+# Every upstream call takes a lease in a Redis sorted set per API key and per target. The
+# member is a random lease id and the score is when the lease expires, so if a worker dies
+# halfway through a request its leases just age out instead of leaking a slot forever.
+# Counting only the leases that haven't expired yet gives the number of requests in flight.
+#
+# When there's no free slot we poll for one for up to CONCURRENCY_QUEUE_TIMEOUT_SECONDS
+# before giving up: a 429 if the caller's own key is at its limit, a 503 if the target is.
+
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local lease_id = ARGV[2]
+local expires_at = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+
+for i = 1, #KEYS do
+    redis.call("ZREMRANGEBYSCORE", KEYS[i], "-inf", now)
+    if redis.call("ZCARD", KEYS[i]) >= tonumber(ARGV[4 + i]) then
+        return i
+    end
+end
+
+for i = 1, #KEYS do
+    redis.call("ZADD", KEYS[i], expires_at, lease_id)
+    -- only ever extend: a short lease must not expire the key under a longer one
+    -- (TTL is -1 for a key that was just created)
+    if redis.call("TTL", KEYS[i]) < ttl then
+        redis.call("EXPIRE", KEYS[i], ttl)
+    end
+end
+return 0
+"""
+
+acquire_script = redis_client.register_script(ACQUIRE_SCRIPT)
+
+# Both stores return 0 when the lease was taken, otherwise the 1-based index of the
+# first key that is full. The memory one is for BACKEND = "memory" (single process).
+
+class RedisLeaseStore:
+    async def try_acquire(self, keys: list[str], limits: list[int], lease_id: str, lease_seconds: float) -> int:
+        now = time.time()
+        args = [now, lease_id, now + lease_seconds, int(lease_seconds) + 1, *limits]
+        return await acquire_script(keys=keys, args=args, client=redis_client)
+
+    async def release(self, keys: list[str], lease_id: str):
+        pipe = redis_client.pipeline()
+        for key in keys:
+            pipe.zrem(key, lease_id)
+        await pipe.execute()
+
+class MemoryLeaseStore:
+    def __init__(self):
+        self.leases: dict[str, dict[str, float]] = {}
+
+    async def try_acquire(self, keys: list[str], limits: list[int], lease_id: str, lease_seconds: float) -> int:
+        now = time.time()
+        for i, (key, limit) in enumerate(zip(keys, limits)):
+            leases = self.leases.get(key, {})
+            for expired in [lease for lease, expires_at in leases.items() if expires_at <= now]:
+                del leases[expired]
+            if len(leases) >= limit:
+                return i + 1
+
+        for key in keys:
+            self.leases.setdefault(key, {})[lease_id] = now + lease_seconds
+        return 0
+
+    async def release(self, keys: list[str], lease_id: str):
+        for key in keys:
+            leases = self.leases.get(key)
+            if leases is None:
+                continue
+            leases.pop(lease_id, None)
+            if not leases:
+                del self.leases[key]
+
+store = MemoryLeaseStore() if BACKEND == "memory" else RedisLeaseStore()
+
+@asynccontextmanager
+async def concurrency_lease(key_id: str, target: str, target_limit: int | None, request_timeout: float):
+    keys = [f"inflight:key:{key_id}"]
+    limits = [MAX_CONCURRENT_REQUESTS_PER_KEY]
+    if target_limit is not None:
+        keys.append(f"inflight:target:{target}")
+        limits.append(target_limit)
+
+    lease_id = uuid.uuid4().hex
+    lease_seconds = request_timeout + CONCURRENCY_LEASE_MARGIN_SECONDS
+
+    deadline = time.monotonic() + CONCURRENCY_QUEUE_TIMEOUT_SECONDS
+    blocked = await store.try_acquire(keys, limits, lease_id, lease_seconds)
+    while blocked and time.monotonic() < deadline:
+        await asyncio.sleep(CONCURRENCY_RETRY_INTERVAL_SECONDS)
+        blocked = await store.try_acquire(keys, limits, lease_id, lease_seconds)
+
+    if blocked == 1:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many concurrent requests for this API key",
+            headers={"Retry-After": "1"}
+        )
+    if blocked == 2:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent requests to the upstream API",
+            headers={"Retry-After": "1"}
+        )
+
+    try:
+        yield
+    finally:
+        await store.release(keys, lease_id)
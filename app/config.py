@@ -1,13 +1,188 @@
+import os
+
+# each target is a base URL, or a list of instances to balance across, e.g.
+# "mock_github": ["http://mock_a:8001", {"url": "http://mock_b:8001", "weight": 2}]
 API_TARGETS = {
     "github": "https://api.github.com",
     "mock_github": "http://mock_server:8001"
 }
 
-REDIS_URL = "redis://redis:6379"
+# round_robin | least_outstanding | peak_ewma, overridable per target
+LOAD_BALANCING_STRATEGY = "peak_ewma"
+LOAD_BALANCING_STRATEGIES = {}
+
+# how quickly the peak EWMA forgets a slow response
+EWMA_DECAY_SECONDS = 10.0
+# latency assumed for an instance until it has answered, so a new one doesn't look fastest
+EWMA_DEFAULT_RTT_SECONDS = 0.05
+
+# passive ejection of an instance after consecutive failed requests
+EJECTION_CONSECUTIVE_FAILURES = 5
+EJECTION_SECONDS = 30
+
+# active health checks, only for targets listed here (api name -> path)
+HEALTH_CHECK_PATHS = {}
+HEALTH_CHECK_INTERVAL_SECONDS = 10
+HEALTH_CHECK_TIMEOUT_SECONDS = 2.0
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+
+# where rate limits, leases, the cache and the log buffer live: "redis" (shared by every
+# worker and instance) or "memory" (this process only, for single-node deployments
+# running a single worker, no Redis needed)
+BACKEND = os.getenv("REXUS_BACKEND", "redis")
+CACHE_MEMORY_MAX_BYTES = 256 * 1024 * 1024
+LOG_BUFFER_MAX_ENTRIES = 100000
+# with the memory backend, the writer flushes early once this many entries are waiting,
+# so a burst gets written out instead of running into LOG_BUFFER_MAX_ENTRIES
+LOG_BUFFER_FLUSH_AT_ENTRIES = 20000
+
+# log records are packed into binary frames per worker and pushed to the buffer as one write
+LOG_FRAME_MAX_RECORDS = 500
+LOG_FRAME_FLUSH_INTERVAL_SECONDS = 0.1
+
+# worker processes per instance, uvicorn reads the same variable for --workers.
+# The memory backend keeps its state in the process, so it only works with one.
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# work that must only run once per cluster (the log writer) is done by whichever worker
+# holds its leader lease, renewed every third of the lease
+LEADER_LEASE_SECONDS = 15
+
+# opened by every worker before it accepts requests, so the first requests after a deploy
+# don't pay for connection setup (upstream ones per instance of every target)
+WARMUP_DB_CONNECTIONS = 5
+WARMUP_REDIS_CONNECTIONS = 10
+WARMUP_UPSTREAM_CONNECTIONS = 2
+WARMUP_TIMEOUT_SECONDS = 10.0
+
+# admin endpoints (routing table, upstreams, cache purges, log export, bulk keys) require this in the
+# X-Admin-Token header, and answer 403 to everyone while it is unset
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+# hot-reloadable routing table, see routing.py for the format
+ROUTES_FILE = os.getenv("ROUTES_FILE")
+ROUTES_REDIS_KEY = "routing_table"
+ROUTES_RELOAD_INTERVAL_SECONDS = 5
 
 MAX_REQUEST_SIZE = 10 * 1024 * 1024
 
 MAX_REQUESTS_PER_MINUTE = 100
 WINDOW_SECONDS = 60
 
-CACHE_EXPIRY_SECONDS = 300
\ No newline at end of file
+# quotas are {window: limit}, checked together with the per-key limit in one Redis call
+QUOTA_WINDOWS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+SLIDING_WINDOW_MAX_SECONDS = 60
+USER_QUOTAS = {"minute": 1000, "day": 100000}
+GLOBAL_QUOTAS = {}
+
+# requests in flight at once, per API key across the cluster (per target limits live on
+# the routing table targets as "max_concurrency", TARGET_MAX_CONCURRENCY is the default)
+MAX_CONCURRENT_REQUESTS_PER_KEY = 20
+TARGET_MAX_CONCURRENCY = {}
+CONCURRENCY_LEASE_MARGIN_SECONDS = 5
+CONCURRENCY_QUEUE_TIMEOUT_SECONDS = 0.5
+CONCURRENCY_RETRY_INTERVAL_SECONDS = 0.025
+
+CACHE_EXPIRY_SECONDS = 300
+
+# purges are announced on this channel so every worker drops its in-process copies
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+
+# optional per-worker copy of hot cache entries in front of Redis, 0 disables it
+CACHE_LOCAL_MAX_ENTRIES = 0
+CACHE_LOCAL_TTL_SECONDS = 5
+
+# negative caching: short TTLs for upstream answers that aren't worth asking again right away,
+# capped by the route's cache_ttl. Cleared early once the path answers with a 2xx.
+NEGATIVE_CACHE_TTLS = {
+    404: 30,
+    410: 30,
+    502: 5,
+    503: 5,
+    504: 5,
+}
+
+# refresh-ahead: the hottest entries are fetched again shortly before they expire
+CACHE_REFRESH_ENABLED = True
+CACHE_REFRESH_INTERVAL_SECONDS = 5
+CACHE_REFRESH_AHEAD_SECONDS = 15
+CACHE_REFRESH_TOP_N = 100
+CACHE_REFRESH_MIN_HITS = 5                 # hits (after decay) before an entry counts as hot
+CACHE_REFRESH_PER_TARGET_PER_MINUTE = 60   # refreshes allowed per upstream target, whole cluster
+CACHE_HIT_DECAY_SECONDS = 300              # hit counts are halved this often
+
+# fetched into the cache at startup, as "api_name/path?query"
+CACHE_PREWARM_URLS = []
+
+# cache entries at least this big are stored compressed with CACHE_COMPRESSION_CODEC
+# (gzip and deflate are always available, br and zstd need the brotli/zstandard packages)
+CACHE_COMPRESSION_CODEC = "gzip"
+CACHE_COMPRESSION_THRESHOLD = 1024
+
+# responses smaller than this are not worth compressing on the fly
+COMPRESSION_MIN_SIZE = 1024
+
+# adaptive concurrency limit per worker, requests over it are shed with a 503
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_INITIAL_LIMIT = 200
+ADAPTIVE_MIN_LIMIT = 20
+ADAPTIVE_MAX_LIMIT = 2000
+ADAPTIVE_SMOOTHING = 0.2
+ADAPTIVE_RTT_TOLERANCE = 1.5
+ADAPTIVE_LONG_WINDOW = 600
+ADAPTIVE_SAMPLE_WINDOW = 50
+ADAPTIVE_BACKOFF_RATIO = 0.9
+
+# share of the adaptive limit each API key priority tier may use, lower tiers are shed first
+PRIORITY_TIERS = {"premium": 1.0, "standard": 0.85, "free": 0.6}
+DEFAULT_PRIORITY_TIER = "standard"
+UNKNOWN_KEY_PRIORITY_TIER = "free"
+PRIORITY_CACHE_SIZE = 100000
+
+# bulk key provisioning: bcrypt runs in a process pool so it doesn't stall the proxy,
+# keys are hashed and inserted KEY_BATCH_CHUNK_SIZE at a time
+KEY_HASHING_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+KEY_BATCH_MAX_KEYS = 10000
+KEY_BATCH_CHUNK_SIZE = 256
+
+# circuit breaker, per API target: open after this many consecutive failures,
+# stay open for BREAKER_RESET_SECONDS, then let a few probe requests through
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+BREAKER_HALF_OPEN_MAX_PROBES = 1
+BREAKER_FAILURE_STATUSES = {502, 503, 504}
+
+# bulkhead, max concurrent upstream requests per API target in each worker
+BULKHEAD_MAX_IN_FLIGHT = 100
+BULKHEAD_QUEUE_TIMEOUT = 0.05
+
+# connection pool of the upstream client each worker shares across requests
+UPSTREAM_MAX_CONNECTIONS = 500
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = 100
+
+# total time budget for an upstream request, overridable per route prefix
+# (these, like the other per-route settings, are only defaults for the routing table)
+UPSTREAM_TIMEOUT_SECONDS = 15.0
+ROUTE_TIMEOUTS = {
+    "github": {"search/": 30.0},
+}
+
+# hedged GETs: if the first attempt hasn't answered by the HEDGE_PERCENTILE latency,
+# send a second one and take whichever finishes first
+HEDGE_ENABLED = False
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 50
+HEDGE_MAX_RATIO = 0.1
+LATENCY_SAMPLE_SIZE = 500
+# cold storage for api_logs: rows older than LOG_RETENTION_DAYS are moved out to
+# Parquet files under LOG_ARCHIVE_DIR, one directory per day
+LOG_ARCHIVE_ENABLED = True
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "archive/logs")
+LOG_RETENTION_DAYS = 7
+LOG_ARCHIVE_INTERVAL_SECONDS = 3600
+LOG_ARCHIVE_CHUNK_ROWS = 50000
+
+# raw log queries: page size cap for /logs/, rows per server-side cursor fetch for /logs/export
+LOG_QUERY_MAX_LIMIT = 1000
+LOG_EXPORT_CHUNK_ROWS = 5000
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import time
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+from .cache import (
+    store, redis_client, CACHE_KEY_PREFIX, make_cache_key, path_index_key, tag_index_key, negative_index_key, forget_locally
+)
+from .config import BACKEND, CACHE_INVALIDATION_CHANNEL, CACHE_LOCAL_MAX_ENTRIES
+from .security import require_admin_token
+
+# Purging cached responses before they expire.
+#
+# Entries can be purged by exact key, by API name and path prefix, or by surrogate tag.
+# Tags come from the upstream's Surrogate-Key (space separated) or Cache-Tag (comma
+# separated) response headers, plus any `cache_tags` set on the route. The index sets
+# written next to every entry (see cache.py) mean a purge only touches the keys it
+# deletes, never the rest of the keyspace.
+#
+# After deleting from Redis the purged keys are published on CACHE_INVALIDATION_CHANNEL,
+# so workers holding in-process copies drop them too.
+
+router = APIRouter(
+    prefix="/cache",
+    tags=["Cache"],
+    dependencies=[Depends(require_admin_token)]
+)
+
+PURGE_BATCH_SIZE = 500
+
+# past this many keys, telling workers to drop their whole local copy is cheaper
+PUBLISH_KEYS_LIMIT = 1000
+
+FLUSH_ALL = "*"
+
+class KeyPurgeRequest(BaseModel):
+    key: str | None = None
+    api_name: str | None = None
+    path: str = ""
+    query_params: dict = {}
+
+class PrefixPurgeRequest(BaseModel):
+    api_name: str
+    path_prefix: str = ""
+
+class TagPurgeRequest(BaseModel):
+    tags: list[str]
+
+def surrogate_tags(headers: dict) -> list[str]:
+    # pops the headers as well, they are meant for us and not for the client
+    tags = (headers.pop("surrogate-key", None) or "").split()
+    tags += [tag.strip() for tag in (headers.pop("cache-tag", None) or "").split(",")]
+    return [tag for tag in tags if tag]
+
+async def announce_purge(cache_keys: list[str]):
+    forget_locally(cache_keys)
+    message = FLUSH_ALL if len(cache_keys) > PUBLISH_KEYS_LIMIT else json.dumps(cache_keys)
+    await store.publish(CACHE_INVALIDATION_CHANNEL, message)
+
+async def purge_keys(cache_keys: list[str]) -> int:
+    if not cache_keys:
+        return 0
+    purged = await store.delete(cache_keys)
+    await announce_purge(cache_keys)
+    return purged
+
+async def purge_index(index_key: str, live_only: bool = False) -> int:
+    # batch by batch, removing members as we go, so an entry cached while the purge
+    # is running stays indexed instead of being dropped from the set unpurged
+    min_score = time.time() if live_only else "-inf"
+    purged = 0
+    purged_keys = []
+    while True:
+        members = await store.index_members(index_key, min_score, PURGE_BATCH_SIZE)
+        if not members:
+            break
+        purged += await store.delete_indexed(index_key, members)
+        purged_keys += members
+
+    if purged_keys:
+        await announce_purge(purged_keys)
+    return purged
+
+async def purge_negative_entries(api_name: str, path: str) -> int:
+    # members whose negative entry already expired may have been cached successfully since
+    return await purge_index(negative_index_key(api_name, path), live_only=True)
+
+async def cache_invalidation_listener():
+    # with the memory backend this process already holds the only copy
+    if not CACHE_LOCAL_MAX_ENTRIES or BACKEND == "memory":
+        return
+
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+    try:
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = message["data"]
+                    forget_locally(None if data == FLUSH_ALL else json.loads(data))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # we may have missed purges while disconnected, so start from scratch
+                logging.error(f"Cache invalidation listener failed, dropping local cache: {e}")
+                forget_locally()
+                await asyncio.sleep(1)
+    finally:
+        await pubsub.aclose()
+
+@router.post("/purge/key")
+async def purge_by_key(request_data: KeyPurgeRequest):
+    if request_data.key:
+        # the key goes straight to DEL, so it must not reach quota counters, leases or log buffers
+        if not request_data.key.startswith(CACHE_KEY_PREFIX):
+            raise HTTPException(status_code=400, detail=f"Cache keys start with '{CACHE_KEY_PREFIX}'.")
+        cache_key = request_data.key
+    elif request_data.api_name:
+        cache_key = make_cache_key(request_data.api_name, request_data.path, request_data.query_params)
+    else:
+        raise HTTPException(status_code=400, detail="Provide either a cache key or an api_name and path.")
+
+    return {"purged": await purge_keys([cache_key])}
+
+@router.post("/purge/prefix")
+async def purge_by_prefix(request_data: PrefixPurgeRequest):
+    # prefixes match whole path segments: "repos/foo" covers "repos/foo/issues", not "repos/foobar"
+    purged = await purge_index(path_index_key(request_data.api_name, request_data.path_prefix))
+    return {"purged": purged}
+
+@router.post("/purge/tags")
+async def purge_by_tags(request_data: TagPurgeRequest):
+    if not request_data.tags:
+        raise HTTPException(status_code=400, detail="Provide at least one tag.")
+
+    purged = 0
+    for tag in request_data.tags:
+        purged += await purge_index(tag_index_key(tag))
+    return {"purged": purged}
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import uuid
+
+from .cache import redis_client
+from .config import BACKEND, LEADER_LEASE_SECONDS
+
+# Leader election for work that has to run in exactly one worker across the cluster.
+#
+# The leader is whoever holds the key leader:<name>, set to a token only that worker knows,
+# with a TTL of LEADER_LEASE_SECONDS. Every worker campaigns every third of the lease: the
+# holder extends it, everybody else tries to take it. If the leader dies its lease runs out
+# and another worker takes over within one lease. Comparing the token first (in Lua, so it's
+# atomic) means a worker that was paused past its lease can never extend or delete the lease
+# of whoever took over in the meantime.
+#
+# With the memory backend there is a single worker, so it's always the leader.
+
+# extends our lease, or takes it if it's free, returns 1 if we hold it afterwards
+CAMPAIGN_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+if redis.call("SET", KEYS[1], ARGV[1], "NX", "PX", ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+RESIGN_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+campaign_script = redis_client.register_script(CAMPAIGN_SCRIPT)
+resign_script = redis_client.register_script(RESIGN_SCRIPT)
+
+class Leadership:
+    def __init__(self, name: str):
+        self.name = name
+        self.key = f"leader:{name}"
+        self.token = uuid.uuid4().hex
+        self.is_leader = BACKEND == "memory"
+
+    async def campaign_once(self):
+        try:
+            held = bool(await campaign_script(
+                keys=[self.key], args=[self.token, int(LEADER_LEASE_SECONDS * 1000)], client=redis_client
+            ))
+        except Exception as e:
+            # we can't tell whether the lease is still ours, so don't act on it
+            logging.error(f"Could not renew the {self.name} leader lease: {e}")
+            held = False
+
+        if held != self.is_leader:
+            logging.info(f"This worker {'is now' if held else 'is no longer'} the {self.name} leader.")
+        self.is_leader = held
+
+    async def campaign(self):
+        if BACKEND == "memory":
+            return
+        while True:
+            await self.campaign_once()
+            await asyncio.sleep(LEADER_LEASE_SECONDS / 3)
+
+    async def resign(self):
+        # lets another worker take over right away instead of after the lease runs out
+        if BACKEND != "memory" and self.is_leader:
+            self.is_leader = False
+            try:
+                await resign_script(keys=[self.key], args=[self.token], client=redis_client)
+            except Exception as e:
+                logging.error(f"Could not release the {self.name} leader lease: {e}")
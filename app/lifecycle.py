@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack
+
+from fastapi import APIRouter
+from sqlalchemy import text
+
+from . import cache, concurrency, leader, rate_limit
+from .balancer import warm_upstream_connections
+from .config import (
+    BACKEND, WARMUP_DB_CONNECTIONS, WARMUP_REDIS_CONNECTIONS, WARMUP_UPSTREAM_CONNECTIONS, WARMUP_TIMEOUT_SECONDS
+)
+from .database import engine
+from .upstream import get_upstream_client
+
+# Startup and shutdown of a worker.
+#
+# A fresh worker opens its connections during lifespan startup: a few database
+# connections, Redis connections for every client (plus the Lua scripts, so the first
+# EVALSHA doesn't bounce with NOSCRIPT) and keep-alive connections to every upstream
+# instance. uvicorn doesn't accept a connection on a worker until its startup is done, so
+# the first requests a worker serves never pay for handshakes, and /health/live answering
+# at all means the worker is warm. Warm-up failures are logged and not fatal, the
+# connection is then opened on first use.
+#
+# Draining is left to uvicorn: on SIGTERM it stops accepting connections and waits up to
+# --timeout-graceful-shutdown (see the Dockerfile) for requests in flight, and only then
+# runs lifespan shutdown, where main.py flushes the log buffer and closes the pools.
+
+router = APIRouter(
+    prefix="/health",
+    tags=["Health"]
+)
+
+async def warm_database():
+    # held open together, otherwise the pool would hand out the same connection every time
+    async with AsyncExitStack() as stack:
+        connections = await asyncio.gather(*(
+            stack.enter_async_context(engine.connect()) for _ in range(WARMUP_DB_CONNECTIONS)
+        ))
+        await asyncio.gather(*(connection.execute(text("SELECT 1")) for connection in connections))
+
+async def warm_redis():
+    if BACKEND == "memory":
+        return
+
+    clients = {
+        id(client): client
+        for client in (cache.redis_client, cache.cache_client, rate_limit.redis_client, concurrency.redis_client)
+    }
+    await asyncio.gather(*(
+        client.ping() for client in clients.values() for _ in range(WARMUP_REDIS_CONNECTIONS)
+    ))
+    await asyncio.gather(
+        rate_limit.redis_client.script_load(rate_limit.QUOTA_SCRIPT),
+        concurrency.redis_client.script_load(concurrency.ACQUIRE_SCRIPT),
+        cache.redis_client.script_load(leader.CAMPAIGN_SCRIPT),
+    )
+
+async def warm_upstreams():
+    await warm_upstream_connections(get_upstream_client(), WARMUP_UPSTREAM_CONNECTIONS)
+
+async def warm_up():
+    start = time.monotonic()
+    steps = {"database": warm_database(), "redis": warm_redis(), "upstreams": warm_upstreams()}
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*steps.values(), return_exceptions=True), WARMUP_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        logging.warning(f"Warm-up took longer than {WARMUP_TIMEOUT_SECONDS}s, serving anyway.")
+    else:
+        for name, result in zip(steps, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Could not warm up {name} connections: {result!r}")
+
+    logging.info(f"Worker ready after {time.monotonic() - start:.2f}s of warm-up.")
+
+@router.get("/live")
+async def liveness():
+    return {"status": "ok"}
@@ -0,0 +1,160 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+
+from fastapi import APIRouter, Header, HTTPException, Request, status
+
+from .config import (
+    ADAPTIVE_CONCURRENCY_ENABLED, ADAPTIVE_INITIAL_LIMIT, ADAPTIVE_MIN_LIMIT, ADAPTIVE_MAX_LIMIT,
+    ADAPTIVE_SMOOTHING, ADAPTIVE_RTT_TOLERANCE, ADAPTIVE_LONG_WINDOW, ADAPTIVE_SAMPLE_WINDOW,
+    ADAPTIVE_BACKOFF_RATIO, PRIORITY_TIERS, DEFAULT_PRIORITY_TIER, UNKNOWN_KEY_PRIORITY_TIER,
+    PRIORITY_CACHE_SIZE
+)
+
+# Adaptive load shedding in front of proxy_request.
+#
+# The limiter keeps the number of requests this worker has in flight near the point where
+# latency starts to climb, instead of a fixed number someone guessed once. It's the
+# "gradient" approach from Netflix's concurrency-limits library:
+#   * a long-term EWMA of request latency approximates latency without queueing
+#   * every ADAPTIVE_SAMPLE_WINDOW requests we compare it to the recent average,
+#     gradient = long / short, clamped to [0.5, 1]
+#   * new limit = limit * gradient + sqrt(limit), smoothed
+# so while latency is flat the limit creeps up, and as soon as requests start queueing
+# (short-term latency above the long-term one) it shrinks. Upstream timeouts additionally
+# cut the limit multiplicatively, AIMD style.
+#
+# Only requests that were answered by the upstream or the cache are latency samples (the
+# proxy marks them with sample_latency). Everything else, a 401, a 429, a 503 from an open
+# breaker or a refused connection, fails fast without queueing anywhere, and counting those
+# would drag the short-term latency down and raise the limit just as an upstream struggles.
+#
+# Requests over the limit get an immediate 503. Priority tiers decide who goes first:
+# each tier may only use its share of the limit (PRIORITY_TIERS), so as the limit shrinks
+# the lowest tier is shed first and the top tier keeps its latency. The check runs before
+# authentication (that's where bcrypt burns CPU), so the tier comes from a small cache of
+# keys we've already authenticated, keyed by public id. Keys we haven't seen yet are
+# treated as UNKNOWN_KEY_PRIORITY_TIER.
+
+router = APIRouter(
+    prefix="/load-shedding",
+    tags=["Resilience"]
+)
+
+class AdaptiveLimiter:
+    def __init__(self):
+        self.limit = float(ADAPTIVE_INITIAL_LIMIT)
+        self.in_flight = 0
+        self.long_rtt = None
+        self.window_total = 0.0
+        self.window_count = 0
+        self.window_max_in_flight = 0
+        self.shed = {tier: 0 for tier in PRIORITY_TIERS}
+
+    def try_acquire(self, tier: str) -> bool:
+        if self.in_flight >= self.limit * PRIORITY_TIERS[tier]:
+            self.shed[tier] += 1
+            return False
+        self.in_flight += 1
+        self.window_max_in_flight = max(self.window_max_in_flight, self.in_flight)
+        return True
+
+    def release(self, rtt: float, dropped: bool, sampled: bool = True):
+        self.in_flight -= 1
+
+        if dropped:
+            self.limit = max(self.limit * ADAPTIVE_BACKOFF_RATIO, ADAPTIVE_MIN_LIMIT)
+            return
+        if not sampled:
+            return
+
+        self.window_total += rtt
+        self.window_count += 1
+        if self.window_count >= ADAPTIVE_SAMPLE_WINDOW:
+            self.update_limit(self.window_total / self.window_count)
+            self.window_total = 0.0
+            self.window_count = 0
+            self.window_max_in_flight = self.in_flight
+
+    def update_limit(self, short_rtt: float):
+        if self.long_rtt is None:
+            self.long_rtt = short_rtt
+            return
+
+        self.long_rtt += (short_rtt - self.long_rtt) * 2 / (ADAPTIVE_LONG_WINDOW + 1)
+        # after a long stretch of overload the long-term average itself drifts up,
+        # pull it back down so the limiter can recognise recovery
+        if self.long_rtt / short_rtt > 2:
+            self.long_rtt *= 0.95
+
+        gradient = max(0.5, min(1.0, ADAPTIVE_RTT_TOLERANCE * self.long_rtt / short_rtt))
+
+        # if we never got close to the limit, low latency says nothing about a higher one
+        if gradient == 1.0 and self.window_max_in_flight < self.limit / 2:
+            return
+
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        new_limit = self.limit * (1 - ADAPTIVE_SMOOTHING) + new_limit * ADAPTIVE_SMOOTHING
+        self.limit = max(ADAPTIVE_MIN_LIMIT, min(ADAPTIVE_MAX_LIMIT, new_limit))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ADAPTIVE_CONCURRENCY_ENABLED,
+            "limit": round(self.limit, 1),
+            "in_flight": self.in_flight,
+            "long_rtt_ms": round(self.long_rtt * 1000, 2) if self.long_rtt else None,
+            "tier_thresholds": {tier: round(self.limit * share, 1) for tier, share in PRIORITY_TIERS.items()},
+            "shed": self.shed,
+        }
+
+limiter = AdaptiveLimiter()
+
+known_priorities: OrderedDict[str, str] = OrderedDict()
+
+def remember_priority(public_id: str, tier: str | None):
+    known_priorities[public_id] = tier if tier in PRIORITY_TIERS else DEFAULT_PRIORITY_TIER
+    known_priorities.move_to_end(public_id)
+    if len(known_priorities) > PRIORITY_CACHE_SIZE:
+        known_priorities.popitem(last=False)
+
+def priority_for(authorization: str | None) -> str:
+    if authorization and authorization.startswith("Bearer "):
+        public_id = authorization[7:].split(".", 1)[0]
+        return known_priorities.get(public_id, UNKNOWN_KEY_PRIORITY_TIER)
+    return UNKNOWN_KEY_PRIORITY_TIER
+
+def sample_latency(request: Request):
+    request.state.latency_sample = True
+
+async def admit_request(request: Request, authorization: str = Header(None)):
+    if not ADAPTIVE_CONCURRENCY_ENABLED:
+        yield
+        return
+
+    tier = priority_for(authorization)
+    if not limiter.try_acquire(tier):
+        logging.debug(f"Shedding {tier} request, {limiter.in_flight} in flight, limit {limiter.limit:.0f}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The gateway is overloaded, please retry shortly.",
+            headers={"Retry-After": "1"}
+        )
+
+    start = time.monotonic()
+    dropped = False
+    try:
+        yield
+    except HTTPException as e:
+        # only a timeout says requests are queueing up. A 502 doesn't: an upstream refusing
+        # connections fails instantly, and backing off for it would shrink the limit of
+        # every target and tier on the worker.
+        dropped = e.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+        raise
+    finally:
+        sampled = getattr(request.state, "latency_sample", False)
+        limiter.release(time.monotonic() - start, dropped, sampled)
+
+@router.get("/")
+async def get_load_shedding_stats():
+    return limiter.stats()
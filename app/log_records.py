@@ -0,0 +1,129 @@
+import json
+import logging
+import struct
+from datetime import datetime, timedelta, timezone
+
+# Binary encoding of buffered log records.
+#
+# Every worker packs the records of its requests into a frame and pushes the whole frame
+# to the log buffer at once (see LogBatcher in logging_worker.py). A frame is
+#
+#   header   <BHH  version, number of strings, number of records
+#   strings  <H length + UTF-8 bytes, for every distinct method, path, user and cache status
+#   records  <qHHHHH  timestamp (µs since the epoch), status code, and the index in the
+#            string table of the method, path, user id and cache status (NO_STRING if none)
+#
+# Strings are interned per frame, so a path or user that shows up 200 times in a frame
+# is stored once and every record is a fixed 18 bytes. That makes decoding a single
+# struct.iter_unpack over the record block instead of parsing JSON and ISO timestamps
+# object by object.
+#
+# Entries written by older versions (one JSON object per list item) are still decoded,
+# they start with "{" where a frame starts with its version byte.
+
+FRAME_VERSION = 1
+
+FRAME_HEADER = struct.Struct("<BHH")
+STRING_LENGTH = struct.Struct("<H")
+RECORD = struct.Struct("<qHHHHH")
+
+NO_STRING = 0xFFFF
+MAX_STRINGS = NO_STRING - 1
+MAX_STRING_BYTES = 0xFFFF
+MAX_RECORDS = 0xFFFF
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def timestamp_us(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+class LogFrame:
+    def __init__(self):
+        self.strings: dict[str, int] = {}
+        self.records = bytearray()
+        self.count = 0
+
+    def intern(self, value: str | None) -> int:
+        if value is None:
+            return NO_STRING
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def full(self) -> bool:
+        # a frame holding a long run of unique paths can run out of string slots first
+        return self.count >= MAX_RECORDS or len(self.strings) >= MAX_STRINGS - 4
+
+    def add(self, timestamp: datetime, http_method: str, request_path: str, status_code: int,
+            user_id: str, cache_status: str | None = None):
+        self.records += RECORD.pack(
+            timestamp_us(timestamp),
+            status_code,
+            self.intern(http_method),
+            self.intern(request_path),
+            self.intern(user_id),
+            self.intern(cache_status)
+        )
+        self.count += 1
+
+    def finish(self) -> bytes:
+        parts = [FRAME_HEADER.pack(FRAME_VERSION, len(self.strings), self.count)]
+        for value in self.strings:
+            # paths past 64 KiB are cut short, the decoder drops a character split in half
+            encoded = value.encode()[:MAX_STRING_BYTES]
+            parts.append(STRING_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+        parts.append(self.records)
+        return b"".join(parts)
+
+def decode_frame(frame: bytes) -> list[dict]:
+    version, string_count, record_count = FRAME_HEADER.unpack_from(frame)
+    if version != FRAME_VERSION:
+        # most likely written by a newer build during a rolling deploy
+        logging.warning(f"Log frame has version {version}, this build only reads version {FRAME_VERSION}.")
+        raise ValueError(f"unknown log frame version {version}")
+
+    offset = FRAME_HEADER.size
+    strings = []
+    for _ in range(string_count):
+        (length,) = STRING_LENGTH.unpack_from(frame, offset)
+        offset += STRING_LENGTH.size
+        strings.append(frame[offset:offset + length].decode(errors="ignore"))
+        offset += length
+
+    records = memoryview(frame)[offset:offset + record_count * RECORD.size]
+    if len(records) != record_count * RECORD.size:
+        raise ValueError(f"log frame is truncated, expected {record_count} records")
+
+    return [
+        {
+            "timestamp_utc": EPOCH + timedelta(microseconds=timestamp),
+            "http_method": strings[method],
+            "request_path": strings[path],
+            "status_code": status_code,
+            "user_id": strings[user],
+            "cache_status": None if cache_status == NO_STRING else strings[cache_status],
+        }
+        for timestamp, status_code, method, path, user, cache_status in RECORD.iter_unpack(records)
+    ]
+
+def decode_json_entry(entry: bytes | str) -> dict:
+    log_entry = json.loads(entry)
+    log_entry["timestamp_utc"] = datetime.fromisoformat(log_entry["timestamp_utc"])
+    log_entry.setdefault("cache_status", None)
+    return log_entry
+
+def decode_log_entries(entries: list[bytes]) -> tuple[list[dict], int]:
+    """Decodes frames and legacy JSON entries alike, returns the rows and the number of entries that failed."""
+    rows = []
+    failed = 0
+    for entry in entries:
+        try:
+            if entry[:1] in (b"{", "{"):
+                rows.append(decode_json_entry(entry))
+            else:
+                rows.extend(decode_frame(entry))
+        except (ValueError, KeyError, IndexError, struct.error):
+            failed += 1
+    return rows, failed
@@ -1,34 +1,161 @@
 import asyncio
 import json
 import logging
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
+from sqlalchemy import insert
 from .database import AsyncSessionLocal
 from .models import Log
-from .cache import redis_client
+from .cache import cache_client
+from .config import (
+    BACKEND, LOG_BUFFER_MAX_ENTRIES, LOG_BUFFER_FLUSH_AT_ENTRIES, LOG_FRAME_MAX_RECORDS, LOG_FRAME_FLUSH_INTERVAL_SECONDS
+)
+from .leader import Leadership
+from .log_records import LogFrame, decode_log_entries
 
-def json_decode_hook(dct):
-    if 'timestamp_utc' in dct:
-        dct['timestamp_utc'] = datetime.fromisoformat(dct['timestamp_utc'])
-    return dct
+LOG_BUFFER_KEY = "api_log_buffer"
+LOG_WRITE_INTERVAL_SECONDS = 60
 
-async def batch_log_writer():
+# Log entries wait in a buffer until the writer below moves them to the database in bulk.
+# By default that's a Redis list shared by all workers; with BACKEND = "memory" it's a
+# bounded queue in this process.
+#
+# Requests don't write to the buffer themselves: each worker packs its records into a
+# binary frame (see log_records.py) and pushes the frame once it holds
+# LOG_FRAME_MAX_RECORDS records or every LOG_FRAME_FLUSH_INTERVAL_SECONDS, so the buffer
+# sees one write per frame instead of one per request.
+#
+# Every worker runs batch_log_writer, but only the one holding the "log_writer" leader
+# lease (see leader.py) flushes on schedule, so there's one writer per cluster. On
+# shutdown every worker flushes once more (draining the buffer is atomic, so that's safe).
+# The in-process buffer also wakes the writer early once it passes
+# LOG_BUFFER_FLUSH_AT_ENTRIES, and only drops entries if it fills up regardless.
+
+class RedisLogBuffer:
+    # Redis holds far more than a burst, and the writer may be another worker anyway
+    flush_requested = None
+
+    async def push(self, frame: bytes, records: int):
+        await cache_client.lpush(LOG_BUFFER_KEY, frame)
+
+    async def drain(self) -> list[bytes]:
+        pipe = cache_client.pipeline()
+        pipe.lrange(LOG_BUFFER_KEY, 0, -1)
+        pipe.delete(LOG_BUFFER_KEY)
+        log_entries, _ = await pipe.execute()
+        return log_entries
+
+class MemoryLogBuffer:
+    def __init__(self, max_entries: int, flush_at_entries: int):
+        self.frames = deque()
+        self.records = 0
+        self.max_entries = max_entries
+        self.flush_at_entries = flush_at_entries
+        self.dropped = 0
+        self.flush_requested = asyncio.Event()
+
+    async def push(self, frame: bytes, records: int):
+        # never make a request wait on logging, if the writer can't keep up we lose entries
+        if self.records + records > self.max_entries:
+            previously_dropped = self.dropped
+            self.dropped += records
+            if previously_dropped == 0 or previously_dropped // 1000 != self.dropped // 1000:
+                logging.warning(f"Log buffer is full, {self.dropped} entries dropped so far.")
+            return
+        self.frames.append(frame)
+        self.records += records
+        if self.records >= self.flush_at_entries:
+            self.flush_requested.set()
+
+    async def drain(self) -> list[bytes]:
+        frames = list(self.frames)
+        self.frames.clear()
+        self.records = 0
+        self.flush_requested.clear()
+        return frames
+
+log_buffer = MemoryLogBuffer(LOG_BUFFER_MAX_ENTRIES, LOG_BUFFER_FLUSH_AT_ENTRIES) if BACKEND == "memory" else RedisLogBuffer()
+
+class LogBatcher:
+    def __init__(self):
+        self.frame = LogFrame()
+
+    def add(self, timestamp: datetime, http_method: str, request_path: str, status_code: int,
+            user_id: str, cache_status: str | None = None) -> bool:
+        """Adds a record to the current frame, returns True once the frame should be flushed."""
+        self.frame.add(timestamp, http_method, request_path, status_code, user_id, cache_status)
+        return self.frame.count >= LOG_FRAME_MAX_RECORDS or self.frame.full()
+
+    async def flush(self):
+        if not self.frame.count:
+            return
+        # swapped out without an await, so records added meanwhile go into the next frame
+        frame, self.frame = self.frame, LogFrame()
+        await log_buffer.push(frame.finish(), frame.count)
+
+log_batcher = LogBatcher()
+
+async def log_frame_flusher():
     while True:
-        await asyncio.sleep(60)
+        await asyncio.sleep(LOG_FRAME_FLUSH_INTERVAL_SECONDS)
         try:
-            pipe = redis_client.pipeline()
-            pipe.lrange("api_log_buffer", 0, -1)
-            pipe.delete("api_log_buffer")
-            logs_to_write_json, _ = await pipe.execute()
+            await log_batcher.flush()
+        except Exception as e:
+            logging.error(f"Could not push buffered log records: {e}")
 
-            if not logs_to_write_json:
-                continue
+def encode_log_entry(http_method: str, request_path: str, status_code: int, user_id: str,
+                     cache_status: str | None = None, timestamp: datetime | None = None) -> str:
+    # JSON for the live feed on /ws/logs, the buffer itself takes binary frames
+    log_entry = {
+        "timestamp_utc": (timestamp or datetime.now(timezone.utc)).isoformat(),
+        "http_method": http_method,
+        "request_path": request_path,
+        "status_code": status_code,
+        "user_id": user_id,
+        "cache_status": cache_status,
+    }
+    return json.dumps(log_entry)
 
-            logs_to_write = [json.loads(log, object_hook=json_decode_hook) for log in logs_to_write_json]
-            
-            async with AsyncSessionLocal() as session:
-                session.add_all([Log(**log_data) for log_data in logs_to_write])
-                await session.commit()
-                logging.info(f"Successfully wrote {len(logs_to_write)} logs to the database.")
-        
-        except Exception as e:
-            logging.error(f"!!! CRITICAL ERROR in log writer: {e}", exc_info=True)
\ No newline at end of file
+log_writer_leadership = Leadership("log_writer")
+
+async def flush_logs() -> int:
+    log_entries = await log_buffer.drain()
+
+    if not log_entries:
+        return 0
+
+    logs_to_write, failed = decode_log_entries(log_entries)
+    if failed:
+        logging.error(f"Dropped {failed} log buffer entries that could not be decoded.")
+    if not logs_to_write:
+        return 0
+
+    # one executemany INSERT, no ORM objects to build and track
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(Log), logs_to_write)
+        await session.commit()
+        logging.info(f"Successfully wrote {len(logs_to_write)} logs to the database.")
+    return len(logs_to_write)
+
+async def wait_for_next_flush():
+    if log_buffer.flush_requested is None:
+        await asyncio.sleep(LOG_WRITE_INTERVAL_SECONDS)
+        return
+    try:
+        await asyncio.wait_for(log_buffer.flush_requested.wait(), timeout=LOG_WRITE_INTERVAL_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+
+async def batch_log_writer():
+    campaign_task = asyncio.create_task(log_writer_leadership.campaign())
+    try:
+        while True:
+            await wait_for_next_flush()
+            if not log_writer_leadership.is_leader:
+                continue
+            try:
+                await flush_logs()
+            except Exception as e:
+                logging.error(f"!!! CRITICAL ERROR in log writer: {e}", exc_info=True)
+    finally:
+        campaign_task.cancel()
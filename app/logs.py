@@ -0,0 +1,107 @@
+import base64
+import binascii
+import json
+import uuid
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import LOG_QUERY_MAX_LIMIT, LOG_EXPORT_CHUNK_ROWS
+from .database import AsyncSessionLocal, get_db
+from .models import Log
+from .security import require_admin_token
+
+# Raw access to api_logs.
+#
+# Both endpoints walk the table in (timestamp_utc, id) order and continue "after the last
+# row seen" instead of using OFFSET, so page 10,000 costs the same index seek as page 1
+# (see the composite indexes on Log). /logs/ returns one page plus an opaque cursor for
+# the next one, /logs/export streams every matching row as NDJSON from a server-side
+# cursor, LOG_EXPORT_CHUNK_ROWS at a time, so an export of millions of rows never has
+# more than one chunk in memory.
+
+router = APIRouter(
+    prefix="/logs",
+    tags=["Logs"],
+    dependencies=[Depends(require_admin_token)]
+)
+
+LOG_COLUMNS = [Log.id, Log.timestamp_utc, Log.user_id, Log.http_method, Log.request_path, Log.status_code, Log.cache_status]
+
+def log_filters(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    user_id: str | None = None,
+    status_code: int | None = None,
+    min_status: int | None = None,
+    path_prefix: str | None = None,
+    cursor: str | None = None
+) -> list:
+    conditions = []
+    if start is not None:
+        conditions.append(Log.timestamp_utc >= start)
+    if end is not None:
+        conditions.append(Log.timestamp_utc < end)
+    if user_id is not None:
+        conditions.append(Log.user_id == user_id)
+    if status_code is not None:
+        conditions.append(Log.status_code == status_code)
+    if min_status is not None:
+        conditions.append(Log.status_code >= min_status)
+    if path_prefix:
+        conditions.append(Log.request_path.startswith(path_prefix, autoescape=True))
+    if cursor:
+        conditions.append(tuple_(Log.timestamp_utc, Log.id) > decode_cursor(cursor))
+    return conditions
+
+def encode_cursor(row) -> str:
+    return base64.urlsafe_b64encode(f"{row.timestamp_utc.isoformat()}|{row.id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(log_id)
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+def log_to_dict(row) -> dict:
+    return {
+        "id": str(row.id),
+        "timestamp_utc": row.timestamp_utc.isoformat(),
+        "user_id": row.user_id,
+        "http_method": row.http_method,
+        "request_path": row.request_path,
+        "status_code": row.status_code,
+        "cache_status": row.cache_status,
+    }
+
+def ordered_query(conditions: list):
+    return select(*LOG_COLUMNS).where(*conditions).order_by(Log.timestamp_utc, Log.id)
+
+@router.get("/")
+async def query_logs(
+    conditions: list = Depends(log_filters),
+    limit: int = Query(100, ge=1, le=LOG_QUERY_MAX_LIMIT),
+    db: AsyncSession = Depends(get_db)
+):
+    rows = (await db.execute(ordered_query(conditions).limit(limit))).all()
+    return {
+        "logs": [log_to_dict(row) for row in rows],
+        # a full page means there may be more, the cursor picks up right after the last row
+        "next_cursor": encode_cursor(rows[-1]) if len(rows) == limit else None,
+    }
+
+async def export_lines(conditions: list):
+    # the session lives as long as the stream, not as long as the request handler
+    async with AsyncSessionLocal() as session:
+        query = ordered_query(conditions).execution_options(yield_per=LOG_EXPORT_CHUNK_ROWS)
+        result = await session.stream(query)
+        async for rows in result.partitions():
+            yield "".join(json.dumps(log_to_dict(row)) + "\n" for row in rows)
+
+@router.get("/export")
+async def export_logs(conditions: list = Depends(log_filters)):
+    return StreamingResponse(export_lines(conditions), media_type="application/x-ndjson")
@@ -1,20 +1,35 @@
-from fastapi import FastAPI, Request, HTTPException, status, Response, Depends
+from fastapi import FastAPI, Request, HTTPException, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from httpx import AsyncClient, ConnectError, ReadTimeout
-from .config import API_TARGETS, MAX_REQUESTS_PER_MINUTE, WINDOW_SECONDS, MAX_REQUEST_SIZE
-from .rate_limit import rate_limit
-from .cache import get_cached_response, set_cached_response, redis_client
+from .rate_limit import check_quotas, quotas_for_request
+from .concurrency import concurrency_lease
+from .load_shedding import router as load_shedding_router, admit_request, remember_priority, sample_latency
+from .cache import get_cached_response, set_cached_response, make_cache_key
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') 
-import json
 from .auth import router
-from .security import authenticate_api_key
+from .security import authenticate_api_key, shutdown_hashing_pool
 from .models import APIKey
-from datetime import datetime, timezone
 from contextlib import asynccontextmanager
 import asyncio
-from .logging_worker import batch_log_writer
+from datetime import datetime, timezone
+from .logging_worker import (
+    batch_log_writer, log_frame_flusher, encode_log_entry, log_batcher, flush_logs, log_writer_leadership
+)
+from .compression import (
+    IDENTITY, UPSTREAM_ACCEPT_ENCODING, compress_for_cache, encode_for_client, is_supported
+)
 from .analytics import router as analytics_router
+from .logs import router as logs_router
+from .resilience import router as resilience_router, call_upstream
+from .balancer import router as upstreams_router, get_pool, health_check_loop
+from .routing import router as routes_router, Route, get_route, reload_routes, routing_watcher
+from .upstream import get_upstream_client, close_upstream_client, send_raw, strip_upstream_headers
+from .invalidation import router as cache_router, cache_invalidation_listener, surrogate_tags, purge_negative_entries
+from .config import BACKEND, WORKERS, NEGATIVE_CACHE_TTLS
+from .database import engine
+from .lifecycle import router as health_router, warm_up
+from .warming import cache_refresh_loop, count_hit
+from .archive import log_archiver
 from fastapi import WebSocket, WebSocketDisconnect
 from typing import List
 
@@ -37,19 +52,61 @@ manager = ConnectionManager()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if BACKEND == "memory" and WORKERS > 1:
+        raise RuntimeError("The memory backend keeps its state in the process, run it with a single worker.")
+
+    try:
+        await reload_routes()
+    except Exception as e:
+        logging.error(f"Could not load the published routing table, using the local one: {e}")
+
+    # the routing table comes first, warming opens connections to the upstreams it lists
+    await warm_up()
+
     log_task = asyncio.create_task(batch_log_writer())
+    log_frame_task = asyncio.create_task(log_frame_flusher())
+    health_check_task = asyncio.create_task(health_check_loop())
+    routing_task = asyncio.create_task(routing_watcher())
+    invalidation_task = asyncio.create_task(cache_invalidation_listener())
+    refresh_task = asyncio.create_task(cache_refresh_loop())
+    archive_task = asyncio.create_task(log_archiver())
     yield
+    shutdown_hashing_pool()
+    archive_task.cancel()
+    refresh_task.cancel()
+    invalidation_task.cancel()
+    routing_task.cancel()
+    health_check_task.cancel()
+    log_frame_task.cancel()
     log_task.cancel()
     try:
         await log_task
     except asyncio.CancelledError:
         logging.info("Log writer task cancelled.")
 
+    # whatever this worker buffered (with Redis, whatever is left in the shared buffer) is
+    # written now rather than waiting for the next leader's cycle, or being lost with the process
+    try:
+        await log_batcher.flush()
+        await flush_logs()
+    except Exception as e:
+        logging.error(f"Could not flush buffered logs on shutdown: {e}", exc_info=True)
+    await log_writer_leadership.resign()
+    await close_upstream_client()
+    await engine.dispose()
+
 
 app = FastAPI(lifespan=lifespan)
 
 app.include_router(router)
 app.include_router(analytics_router)
+app.include_router(logs_router)
+app.include_router(resilience_router)
+app.include_router(upstreams_router)
+app.include_router(routes_router)
+app.include_router(load_shedding_router)
+app.include_router(cache_router)
+app.include_router(health_router)
 
 origins = [
     "http://localhost:5173",
@@ -63,11 +120,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_target_url(api_name: str) -> str:
-    target_url = API_TARGETS.get(api_name)
-    if not target_url:
+async def record_log(http_method: str, request_path: str, status_code: int, user_id: str, cache_status: str | None = None):
+    timestamp = datetime.now(timezone.utc)
+    if log_batcher.add(timestamp, http_method, request_path, status_code, user_id, cache_status):
+        await log_batcher.flush()
+
+    # JSON is only for the live feed, no point building it while nobody is watching
+    if manager.active_connections:
+        await manager.broadcast(encode_log_entry(http_method, request_path, status_code, user_id, cache_status, timestamp))
+
+def set_encoding_headers(response_headers: dict, content_encoding: str):
+    if content_encoding != IDENTITY:
+        response_headers["content-encoding"] = content_encoding
+
+    # the body depends on what the client accepts, so shared caches downstream must key on it
+    vary = response_headers.get("vary")
+    if not vary:
+        response_headers["vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        response_headers["vary"] = f"{vary}, Accept-Encoding"
+
+def get_proxy_route(api_name: str, path: str) -> Route:
+    route = get_route(api_name, path)
+    if not route:
         raise HTTPException(status_code=400, detail="Invalid API name provided.")
-    return target_url
+    return route
 
 
 @app.api_route('/proxy/{api_name}/{path:path}', methods=["GET", "POST", "PUT", "DELETE"])
@@ -75,38 +152,52 @@ async def proxy_request(
     api_name: str, 
     path: str, 
     request: Request,
+    # declared before the API key so overload is shed before we spend a bcrypt check on it
+    _admission: None = Depends(admit_request),
     api_key: APIKey = Depends(authenticate_api_key)
 ):
+    remember_priority(api_key.public_id, api_key.priority)
+
     try:
-        current_requests, timestamp = await rate_limit(
-            key_id=api_key.public_id, 
-            limit=api_key.requests_per_minute_limit
-        )
-        
-        fresh_rate_limit_headers = {
-            "X-RateLimit-Limit": str(api_key.requests_per_minute_limit),
-            "X-RateLimit-Remaining": str(api_key.requests_per_minute_limit - current_requests),
-            "X-RateLimit-Reset": str(timestamp + WINDOW_SECONDS)
-        }
+        # looked up once, so the whole request runs against a single version of the table
+        route = get_proxy_route(api_name, path)
+
+        # every quota that applies (key, user, route, global) in one round trip,
+        # the headers report whichever one is closest to running out
+        quota = await check_quotas(quotas_for_request(api_key, route))
+        fresh_rate_limit_headers = quota.headers()
         
+        accept_encoding = request.headers.get("accept-encoding")
+
+        cacheable = request.method == "GET" and route.cache_ttl > 0
+
         # check for cached values
-        if request.method == "GET":
-            query_parameters = dict(request.query_params)
-            serialized_query_parametes = json.dumps(query_parameters, sort_keys=True)
-            cache_key = f"cache:{api_name}:{path}:{serialized_query_parametes}"
+        if cacheable:
+            cache_key = make_cache_key(api_name, path, dict(request.query_params))
 
             cached_response = await get_cached_response(cache_key)
             if cached_response is not None:
-                log_entry = {"timestamp_utc": datetime.now(timezone.utc).isoformat(), "http_method": request.method, "request_path": path, "status_code": cached_response["status_code"], "user_id": api_key.user_id}
-                log_entry_json = json.dumps(log_entry)
-                await redis_client.lpush("api_log_buffer", log_entry_json)
-                await manager.broadcast(log_entry_json)
+                sample_latency(request)
+                negative = cached_response.get("negative", False)
+                if not negative:
+                    count_hit(cache_key)
+                await record_log(
+                    request.method, path, cached_response["status_code"], api_key.user_id,
+                    "negative_hit" if negative else "hit"
+                )
 
                 response_headers = cached_response["headers"]
+                response_headers["x-cache"] = "HIT-NEGATIVE" if negative else "HIT"
+                content, content_encoding = encode_for_client(
+                    cached_response["body"],
+                    cached_response["encoding"],
+                    accept_encoding,
+                    response_headers.get("content-type")
+                )
+                set_encoding_headers(response_headers, content_encoding)
                 response_headers.update(fresh_rate_limit_headers)
-                response_headers.pop("content-length", None)
                 return Response(
-                    content=json.dumps(cached_response["content"]),
+                    content=content,
                     status_code=cached_response["status_code"], 
                     headers=response_headers
                 )
@@ -115,86 +206,99 @@ async def proxy_request(
         body = await request.body()
         request_size = len(body)
 
-        if request_size > MAX_REQUEST_SIZE:
+        if request_size > route.max_body_size:
             raise HTTPException(status_code=413, detail="Payload Too Large")
 
-        async with AsyncClient() as client:
-            # remove the client's 'host' header, as it's specific to the incoming connection
-            # we don't want the actual api to recieve "localhost:8000", it will think something's wrong
-            # also, header keys are lowercased by the ASGI server, so we just use 'host'
-            request_headers = dict(request.headers)
-            request_headers.pop("host", None)
-
-            base_url = get_target_url(api_name)  
-            target_url = f"{base_url}/{path}"
-
-            try:
-                response = await client.request(
-                    method=request.method, 
-                    url=target_url, 
-                    headers=request_headers, 
-                    params=request.query_params,
-                    content=body
-                )
-            except (ConnectError, ReadTimeout):
-                raise HTTPException(
-                    status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail="The upstream API is unavailable."
-                )
-            
-            log_entry = {
-                "timestamp_utc": datetime.now(timezone.utc).isoformat(),
-                "http_method": request.method,
-                "request_path": path,
-                "status_code": response.status_code,
-                "user_id": api_key.user_id,
-            }
-            log_entry_json = json.dumps(log_entry)
-            await redis_client.lpush("api_log_buffer", log_entry_json)
-            await manager.broadcast(log_entry_json)
-
-
-            # remove hop-by-hop headers from the target's response
-            # this allows our server to generate correct headers for the client
-            response_headers = dict(response.headers)
-            response_headers.pop("content-encoding", None)
-            response_headers.pop("content-length", None)
-            response_headers.pop("transfer-encoding", None)
-            response_headers.pop("connection", None)
-
-
-            # I learned that X means experimental header, which are different from the standard ones
-            # Although it was depreceated in 2012, it's still widely used
-            response_headers.pop("x-ratelimit-limit", None)
-            response_headers.pop("x-ratelimit-remaining", None)
-            response_headers.pop("x-ratelimit-reset", None)
-            
-            # Add our fresh rate limit headers
-            response_headers.update(fresh_rate_limit_headers)
+        client = get_upstream_client()
+
+        # remove the client's 'host' header, as it's specific to the incoming connection
+        # we don't want the actual api to recieve "localhost:8000", it will think something's wrong
+        # also, header keys are lowercased by the ASGI server, so we just use 'host'
+        request_headers = dict(request.headers)
+        request_headers.pop("host", None)
+        request_headers["accept-encoding"] = UPSTREAM_ACCEPT_ENCODING
 
-            logging.info(f"Proxying request: {request.method} {target_url} - Status: {response.status_code}")
-
-            if request.method == "GET" and response.status_code == 200:
-                # Cache the original response from the upstream API, not our modified one
-                response_dict = {
-                    "content": response.json(), 
-                    "status_code": response.status_code, 
-                    "headers": dict(response.headers) 
-                }
-                await set_cached_response(cache_key, response_dict)
-
-            return Response(
-                content=response.content, 
-                status_code=response.status_code, 
-                headers=response_headers
+        pool = get_pool(route.target)
+        timeout = route.timeout
+
+        async def send_to(base_url: str):
+            upstream_request = client.build_request(
+                method=request.method, 
+                url=f"{base_url}/{path}", 
+                headers=request_headers, 
+                params=request.query_params,
+                content=body,
+                timeout=timeout
             )
+            return await send_raw(client, upstream_request)
+
+        # the lease only covers the upstream call, cache hits never wait for a slot
+        async with concurrency_lease(api_key.public_id, route.target, route.target_max_concurrency, timeout):
+            # each attempt (including a hedge) picks its own instance from the pool
+            response, content = await call_upstream(route.target, request.method, timeout, lambda: pool.dispatch(send_to))
+        sample_latency(request)
+        
+        await record_log(request.method, path, response.status_code, api_key.user_id, "miss" if cacheable else None)
+
+        content_encoding = response.headers.get("content-encoding", IDENTITY).strip().lower()
+        response_headers = strip_upstream_headers(response.headers)
+        cache_tags = surrogate_tags(response_headers) + route.cache_tags
+        content_type = response_headers.get("content-type")
+
+        logging.info(f"Proxying request: {request.method} {response.request.url} - Status: {response.status_code}")
+
+        # an encoding we can't decode (or stacked encodings) is passed through untouched and never cached
+        if not is_supported(content_encoding):
+            response_headers["content-encoding"] = response.headers["content-encoding"]
+            response_headers.update(fresh_rate_limit_headers)
+            return Response(content=content, status_code=response.status_code, headers=response_headers)
+
+        # a successful write means "not found" and error answers cached for the path are stale.
+        # GETs skip the extra round trip: a cacheable 200 overwrites its own negative entry
+        # below, and the rest of the path's entries expire within seconds anyway
+        if request.method != "GET" and 200 <= response.status_code < 300:
+            await purge_negative_entries(api_name, path)
+
+        negative_ttl = min(NEGATIVE_CACHE_TTLS.get(response.status_code, 0), route.cache_ttl)
+
+        if cacheable and (response.status_code == 200 or negative_ttl > 0):
+            # Cache the original response from the upstream API, not our modified one
+            content, content_encoding = compress_for_cache(content, content_encoding, content_type)
+            if response.status_code == 200:
+                await set_cached_response(cache_key, {
+                    "status_code": response.status_code,
+                    "headers": dict(response_headers),
+                    "encoding": content_encoding,
+                    "body": content,
+                    "source": {"api_name": api_name, "path": path, "params": dict(request.query_params)}
+                }, route.cache_ttl, api_name, path, cache_tags)
+            else:
+                await set_cached_response(cache_key, {
+                    "status_code": response.status_code,
+                    "headers": dict(response_headers),
+                    "encoding": content_encoding,
+                    "body": content,
+                    "negative": True
+                }, negative_ttl, api_name, path, cache_tags)
+
+        if cacheable:
+            response_headers["x-cache"] = "MISS"
+
+        content, content_encoding = encode_for_client(content, content_encoding, accept_encoding, content_type)
+        set_encoding_headers(response_headers, content_encoding)
+
+        # Add our fresh rate limit headers
+        response_headers.update(fresh_rate_limit_headers)
+
+        return Response(
+            content=content, 
+            status_code=response.status_code, 
+            headers=response_headers
+        )
 
     except HTTPException as e:
         if e.status_code == 429:
-            log_entry = {"timestamp_utc": datetime.now(timezone.utc).isoformat(), "http_method": request.method, "request_path": path, "status_code": 429, "user_id": api_key.user_id}
-            log_entry_json = json.dumps(log_entry)
-            await redis_client.lpush("api_log_buffer", log_entry_json)
-            await manager.broadcast(log_entry_json)
+            await record_log(request.method, path, 429, api_key.user_id)
         
         # re-raise the exception so FastAPI can send response to client
         raise e
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, func, Integer
+from sqlalchemy import Column, String, Boolean, DateTime, func, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from sqlalchemy.orm import declarative_base
@@ -18,6 +18,7 @@ class APIKey(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=True)
     requests_per_minute_limit = Column(Integer, default=100)
+    priority = Column(String(16), nullable=False, server_default="standard")
 
 class Log(Base):
     __tablename__ = 'api_logs'
@@ -28,3 +29,10 @@ class Log(Base):
     http_method = Column(String(10), nullable=False)
     request_path = Column(String, nullable=False)
     status_code = Column(Integer, nullable=False)
+    cache_status = Column(String(16), nullable=True)   # hit, negative_hit or miss, empty when not cacheable
+
+    # keyset pagination for /logs walks (timestamp_utc, id), optionally for one user
+    __table_args__ = (
+        Index("ix_api_logs_timestamp_utc_id", "timestamp_utc", "id"),
+        Index("ix_api_logs_user_id_timestamp_utc_id", "user_id", "timestamp_utc", "id"),
+    )
@@ -1,8 +1,12 @@
 import redis.asyncio as redis
 import time
 import uuid
+from collections import deque
 from fastapi import HTTPException
-from .config import REDIS_URL, MAX_REQUESTS_PER_MINUTE, WINDOW_SECONDS
+from .config import (
+    REDIS_URL, BACKEND, MAX_REQUESTS_PER_MINUTE, WINDOW_SECONDS, QUOTA_WINDOWS, SLIDING_WINDOW_MAX_SECONDS,
+    USER_QUOTAS, GLOBAL_QUOTAS
+)
 
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
@@ -12,36 +16,188 @@ redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 # rejected as it was not scalable. The naive approach required fetching all request
 # timestamps to the client for filtering, which creates a performance bottleneck under load.
 #
-# This implementation offloads all heavy lifting to Redis. It uses a pipeline to atomically
-# execute four commands in a single network trip: clean old records (ZREMRANGEBYSCORE),
-# add the new request (ZADD), count the current requests (ZCARD), and set an expiry for
-# garbage collection. 
+# This implementation offloads all heavy lifting to Redis. It used to be a pipeline of four
+# commands: clean old records (ZREMRANGEBYSCORE), add the new request (ZADD), count the
+# current requests (ZCARD), and set an expiry for garbage collection.
+#
+# That grew into a quota engine: a request is now checked against several limits at once
+# (per key, per user, per route, global), each with its own window, in a single Lua script.
+# The script first checks every counter and only records the request if all of them have
+# room, so a rejected request never eats into any quota, and adding dimensions doesn't add
+# network round trips.
+#
+# Short windows (up to SLIDING_WINDOW_MAX_SECONDS) keep the sorted set sliding window.
+# Longer ones (hour, day) would need a sorted set entry per request for the whole window,
+# so they use a fixed window counter (INCR on a key per time bucket) instead.
+
+QUOTA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local member = ARGV[2]
+local counts = {}
+
+for i = 1, #KEYS do
+    local limit = tonumber(ARGV[i * 3])
+    local window = tonumber(ARGV[i * 3 + 1])
+    local kind = ARGV[i * 3 + 2]
+    local count
+    if kind == "sliding" then
+        redis.call("ZREMRANGEBYSCORE", KEYS[i], 0, now - window)
+        count = redis.call("ZCARD", KEYS[i])
+    else
+        count = tonumber(redis.call("GET", KEYS[i]) or "0")
+    end
+    if count >= limit then
+        return {0, i, count}
+    end
+    counts[i] = count
+end
+
+local result = {1, 0}
+for i = 1, #KEYS do
+    local window = tonumber(ARGV[i * 3 + 1])
+    if ARGV[i * 3 + 2] == "sliding" then
+        redis.call("ZADD", KEYS[i], now, member)
+        redis.call("EXPIRE", KEYS[i], math.ceil(window))
+    else
+        redis.call("INCR", KEYS[i])
+        redis.call("EXPIRE", KEYS[i], math.ceil(window))
+    end
+    result[i + 2] = counts[i] + 1
+end
+return result
+"""
+
+quota_script = redis_client.register_script(QUOTA_SCRIPT)
+
+# With BACKEND = "memory" the same checks run against dicts in this process instead,
+# for single-node deployments where the round trip to Redis is pure overhead.
+# Both stores take the quotas' keys and return the script's result shape:
+# [1, 0, used...] when the request is allowed, [0, blocking index (1-based), used] when not.
+
+class RedisQuotaStore:
+    async def apply(self, keys: list[str], quotas: list, now: float) -> list:
+        args = [now, f"{now}{uuid.uuid4()}"]
+        for quota in quotas:
+            args += [quota.limit, quota.window_seconds, "sliding" if quota.sliding else "fixed"]
+        return await quota_script(keys=keys, args=args, client=redis_client)
+
+class MemoryQuotaStore:
+    SWEEP_INTERVAL_SECONDS = 60
+
+    def __init__(self):
+        self.sliding: dict[str, deque] = {}
+        self.fixed: dict[str, tuple[int, float]] = {}
+        self.next_sweep = 0.0
+
+    def _count(self, key: str, quota, now: float) -> int:
+        if quota.sliding:
+            timestamps = self.sliding.get(key)
+            if not timestamps:
+                return 0
+            while timestamps and timestamps[0] <= now - quota.window_seconds:
+                timestamps.popleft()
+            return len(timestamps)
+        count, expires_at = self.fixed.get(key, (0, 0.0))
+        return count if expires_at > now else 0
+
+    def _sweep(self, now: float):
+        # windows that nobody has used for a while, so idle keys don't pile up
+        self.sliding = {key: timestamps for key, timestamps in self.sliding.items()
+                        if timestamps and timestamps[-1] > now - SLIDING_WINDOW_MAX_SECONDS}
+        self.fixed = {key: value for key, value in self.fixed.items() if value[1] > now}
+        self.next_sweep = now + self.SWEEP_INTERVAL_SECONDS
+
+    async def apply(self, keys: list[str], quotas: list, now: float) -> list:
+        if now >= self.next_sweep:
+            self._sweep(now)
+
+        counts = []
+        for i, (key, quota) in enumerate(zip(keys, quotas)):
+            count = self._count(key, quota, now)
+            if count >= quota.limit:
+                return [0, i + 1, count]
+            counts.append(count)
+
+        for key, quota, count in zip(keys, quotas, counts):
+            if quota.sliding:
+                self.sliding.setdefault(key, deque()).append(now)
+            else:
+                # the key names the bucket, so it only has to outlive the window
+                self.fixed[key] = (count + 1, now + quota.window_seconds)
+        return [1, 0, *(count + 1 for count in counts)]
 
-async def rate_limit(key_id: str, limit: int):
-    now = int(time.time())
+store = MemoryQuotaStore() if BACKEND == "memory" else RedisQuotaStore()
 
-    redis_key = f"rate_limit:{key_id}"
+class Quota:
+    def __init__(self, scope: str, identifier: str, limit: int, window: str | int):
+        self.scope = scope
+        self.identifier = identifier
+        self.limit = limit
+        self.window_seconds = QUOTA_WINDOWS[window] if isinstance(window, str) else window
+        self.window_name = window if isinstance(window, str) else f"{window}s"
+        self.sliding = self.window_seconds <= SLIDING_WINDOW_MAX_SECONDS
 
-    time_window = now - WINDOW_SECONDS
+    def redis_key(self, now: float) -> str:
+        if self.scope == "key" and self.window_seconds == WINDOW_SECONDS:
+            # same key the single-limit rate limiter always used, so counts survive the upgrade
+            return f"rate_limit:{self.identifier}"
+        key = f"quota:{self.scope}:{self.identifier}:{self.window_name}"
+        if self.sliding:
+            return key
+        return f"{key}:{int(now // self.window_seconds)}"
 
-    pipe = redis_client.pipeline()
+    def reset_at(self, now: float) -> int:
+        if self.sliding:
+            return int(now) + self.window_seconds
+        return (int(now // self.window_seconds) + 1) * self.window_seconds
 
-    pipe.zremrangebyscore(redis_key, 0, time_window)
+class QuotaResult:
+    def __init__(self, quota: Quota, used: int, now: float):
+        self.quota = quota
+        self.limit = quota.limit
+        self.remaining = max(quota.limit - used, 0)
+        self.reset = quota.reset_at(now)
+        self.used = used
 
-    unique_request_id = f"{now}{uuid.uuid4()}"
-    pipe.zadd(redis_key, {unique_request_id: now})
+    def headers(self) -> dict:
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset),
+            "X-RateLimit-Scope": self.quota.scope,
+        }
 
-    pipe.zcard(redis_key)
+async def check_quotas(quotas: list[Quota]) -> QuotaResult:
+    """Checks and records one request against all quotas, returning the most restrictive one.
 
-    pipe.expire(redis_key, WINDOW_SECONDS)
+    Raises a 429 (with the blocking quota's headers) if any quota is exhausted.
+    """
+    now = time.time()
+    keys = [quota.redis_key(now) for quota in quotas]
+    result = await store.apply(keys, quotas, now)
 
-    results = await pipe.execute()
+    if result[0] == 0:
+        blocked = QuotaResult(quotas[result[1] - 1], result[2], now)
+        headers = blocked.headers()
+        headers["Retry-After"] = str(max(blocked.reset - int(now), 1))
+        raise HTTPException(status_code=429, detail="Too many requests", headers=headers)
 
-    # index 2 cuz the third command is what actually counts the requests in window
-    current_requests = results[2]
+    results = [QuotaResult(quota, used, now) for quota, used in zip(quotas, result[2:])]
+    return min(results, key=lambda r: r.remaining)
 
-    if current_requests > limit:
-        raise HTTPException(status_code=429, detail="Too many requests")
-    
-    return current_requests, now
+def quotas_for_request(api_key, route) -> list[Quota]:
+    quotas = [Quota("key", api_key.public_id, api_key.requests_per_minute_limit, "minute")]
+    # route limits are counted against the route that sets them, so child routes that only
+    # inherit them share one counter with their parent instead of each getting a fresh one
+    if route.requests_per_minute is not None:
+        scope = route.defined_at("requests_per_minute")
+        quotas.append(Quota("key_route", f"{api_key.public_id}:{scope}", route.requests_per_minute, "minute"))
+    # a user's keys share these, so creating more keys doesn't multiply the allowance
+    quotas += [Quota("user", api_key.user_id, limit, window) for window, limit in USER_QUOTAS.items()]
+    quotas += [Quota("route", route.defined_at("quotas"), limit, window) for window, limit in route.quotas.items()]
+    quotas += [Quota("global", "all", limit, window) for window, limit in GLOBAL_QUOTAS.items()]
+    return quotas
 
+async def rate_limit(key_id: str, limit: int = MAX_REQUESTS_PER_MINUTE):
+    result = await check_quotas([Quota("key", key_id, limit, WINDOW_SECONDS)])
+    return result.used, result.reset - WINDOW_SECONDS
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from fastapi import APIRouter, HTTPException, status
+from httpx import TransportError
+
+from .config import (
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS, BREAKER_HALF_OPEN_MAX_PROBES, BREAKER_FAILURE_STATUSES,
+    BULKHEAD_MAX_IN_FLIGHT, BULKHEAD_QUEUE_TIMEOUT,
+    HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MAX_RATIO, LATENCY_SAMPLE_SIZE
+)
+
+# Per-target resilience: a circuit breaker so we fail fast while an upstream is down,
+# a bulkhead so one slow upstream can't eat all of a worker's capacity, a timeout budget
+# per route (from the routing table), and optional hedged GETs to cut tail latency.
+#
+# All of this state lives in the worker process. That's deliberate, every check here runs
+# on every request and has to cost nothing, and each worker finding out about an outage
+# on its own only costs a handful of failed requests.
+
+router = APIRouter(
+    prefix="/resilience",
+    tags=["Resilience"]
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# cancellation message for the slower attempt of a hedged request, so the balancer
+# doesn't count it against its instance
+HEDGE_LOST = "hedge lost"
+
+class CircuitBreaker:
+    def __init__(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.rejections = 0
+
+    def retry_after(self) -> int:
+        return max(int(self.opened_at + BREAKER_RESET_SECONDS - time.monotonic()) + 1, 1)
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < BREAKER_RESET_SECONDS:
+                self.rejections += 1
+                return False
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+            logging.info("Circuit breaker half-open, probing upstream.")
+
+        if self.state == HALF_OPEN:
+            if self.probes_in_flight >= BREAKER_HALF_OPEN_MAX_PROBES:
+                self.rejections += 1
+                return False
+            self.probes_in_flight += 1
+
+        return True
+
+    def record_success(self):
+        # a slow request that started before the breaker opened can still finish after it;
+        # only a half-open probe gets to decide that the upstream recovered
+        if self.state == OPEN:
+            return
+        if self.state == HALF_OPEN:
+            logging.info("Circuit breaker closed, upstream recovered.")
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.probes_in_flight = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.state != OPEN:
+                logging.warning(f"Circuit breaker opened after {self.consecutive_failures} consecutive failures.")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.probes_in_flight = 0
+
+    def release_probe(self):
+        # a probe that ended without a verdict (e.g. the client went away) frees its slot
+        if self.state == HALF_OPEN and self.probes_in_flight > 0:
+            self.probes_in_flight -= 1
+
+class Bulkhead:
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.rejections = 0
+
+    async def acquire(self) -> bool:
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=BULKHEAD_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejections += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+class LatencyTracker:
+    def __init__(self):
+        self.samples = deque(maxlen=LATENCY_SAMPLE_SIZE)
+        self._percentile = None
+        self._stale = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self._stale += 1
+
+    def percentile(self) -> float | None:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        # sorting the window on every request would be wasteful, a slightly stale
+        # threshold is fine for deciding when to hedge
+        if self._percentile is None or self._stale >= len(self.samples) // 10:
+            ordered = sorted(self.samples)
+            self._percentile = ordered[int((len(ordered) - 1) * HEDGE_PERCENTILE / 100)]
+            self._stale = 0
+        return self._percentile
+
+class TargetGuard:
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.bulkhead = Bulkhead(BULKHEAD_MAX_IN_FLIGHT)
+        self.latency = LatencyTracker()
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def can_hedge(self) -> bool:
+        return self.hedges_sent < self.requests * HEDGE_MAX_RATIO
+
+    def stats(self) -> dict:
+        return {
+            "breaker_state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "breaker_rejections": self.breaker.rejections,
+            "bulkhead_in_flight": self.bulkhead.in_flight,
+            "bulkhead_limit": self.bulkhead.max_in_flight,
+            "bulkhead_rejections": self.bulkhead.rejections,
+            "requests": self.requests,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "hedge_threshold_ms": round(self.latency.percentile() * 1000, 2) if self.latency.percentile() else None,
+        }
+
+guards: dict[str, TargetGuard] = {}
+
+def get_guard(api_name: str) -> TargetGuard:
+    guard = guards.get(api_name)
+    if guard is None:
+        guard = guards[api_name] = TargetGuard()
+    return guard
+
+async def send_hedged(guard: TargetGuard, send, hedge_delay: float):
+    primary = asyncio.create_task(send())
+    pending = {primary}
+    hedge = None
+    error = None
+    cancel_reason = None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+        if not done:
+            guard.hedges_sent += 1
+            hedge = asyncio.create_task(send())
+            pending.add(hedge)
+
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        guard.hedges_won += 1
+                    cancel_reason = HEDGE_LOST
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # also runs when the timeout budget cancels us, so no attempt outlives the request
+        for task in pending:
+            task.cancel(cancel_reason)
+
+async def call_upstream(api_name: str, method: str, timeout: float, send):
+    """Runs `send` behind the target's guards. `send` is a coroutine factory returning (response, content)."""
+    guard = get_guard(api_name)
+
+    if not guard.breaker.allow():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The upstream API is unavailable (circuit open).",
+            headers={"Retry-After": str(guard.breaker.retry_after())}
+        )
+
+    if not await guard.bulkhead.acquire():
+        guard.breaker.release_probe()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many in-flight requests to the upstream API.",
+            headers={"Retry-After": "1"}
+        )
+
+    guard.requests += 1
+    hedge_delay = guard.latency.percentile() if HEDGE_ENABLED and method == "GET" else None
+    start = time.monotonic()
+    verdict = False
+
+    try:
+        if hedge_delay is not None and hedge_delay < timeout and guard.can_hedge():
+            result = await asyncio.wait_for(send_hedged(guard, send, hedge_delay), timeout=timeout)
+        else:
+            result = await asyncio.wait_for(send(), timeout=timeout)
+    except asyncio.TimeoutError:
+        guard.timeouts += 1
+        guard.failures += 1
+        guard.breaker.record_failure()
+        verdict = True
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="The upstream API timed out."
+        )
+    except TransportError:
+        guard.failures += 1
+        guard.breaker.record_failure()
+        verdict = True
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="The upstream API is unavailable."
+        )
+    finally:
+        guard.bulkhead.release()
+        if not verdict:
+            guard.breaker.release_probe()
+
+    response = result[0]
+    if response.status_code in BREAKER_FAILURE_STATUSES:
+        guard.failures += 1
+        guard.breaker.record_failure()
+    else:
+        guard.latency.record(time.monotonic() - start)
+        guard.breaker.record_success()
+
+    return result
+
+@router.get("/")
+async def get_resilience_stats():
+    return {api_name: guard.stats() for api_name, guard in guards.items()}
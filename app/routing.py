@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import os
+
+from fastapi import APIRouter, Body, Depends, HTTPException
+
+from . import balancer
+from .cache import redis_client
+from .config import (
+    BACKEND, API_TARGETS, LOAD_BALANCING_STRATEGIES, HEALTH_CHECK_PATHS, ROUTE_TIMEOUTS, TARGET_MAX_CONCURRENCY,
+    CACHE_EXPIRY_SECONDS, UPSTREAM_TIMEOUT_SECONDS, MAX_REQUEST_SIZE,
+    ROUTES_FILE, ROUTES_REDIS_KEY, ROUTES_RELOAD_INTERVAL_SECONDS, QUOTA_WINDOWS
+)
+from .security import require_admin_token
+
+# The routing table maps /proxy/{path} to an upstream target plus the policies for that route.
+#
+# It is loaded from Redis (ROUTES_REDIS_KEY) if a table has been published there, otherwise
+# from ROUTES_FILE, otherwise built from the constants in config.py. The format is:
+#
+#   {
+#     "targets": {
+#       "mock_github": {"upstreams": ["http://mock_server:8001"], "strategy": "peak_ewma", "health_path": "/health",
+#                       "max_concurrency": 200}
+#     },
+#     "routes": [
+#       {"path": "mock_github", "cache_ttl": 300},
+#       {"path": "mock_github/search", "cache_ttl": 30, "timeout": 30, "requests_per_minute": 10},
+#       {"path": "mock_github/orgs", "quotas": {"second": 50, "day": 100000}, "cache_tags": ["orgs"]},
+#       {"path": "gh/repos/*/issues", "target": "github", "cache_ttl": 0}
+#     ]
+#   }
+#
+# A route's first path segment is the API name clients use, and its target defaults to that
+# name. Routes inherit any policy they don't set from the closest route above them.
+#
+# Routes are compiled into a trie of path segments, so a lookup costs one dict access per
+# segment of the request path, however many routes there are. Literal segments win over
+# "*" wildcards, and the deepest route seen along the way is the match.
+#
+# Reloading builds a whole new table and then swaps the module-level reference, so a request
+# always sees one consistent table, and never a half-applied update.
+
+router = APIRouter(
+    prefix="/routes",
+    tags=["Routes"],
+    dependencies=[Depends(require_admin_token)]
+)
+
+POLICY_DEFAULTS = {
+    "cache_ttl": CACHE_EXPIRY_SECONDS,       # 0 disables caching on the route
+    "timeout": UPSTREAM_TIMEOUT_SECONDS,
+    "max_body_size": MAX_REQUEST_SIZE,
+    "requests_per_minute": None,             # extra per-key limit for this route only
+    "quotas": {},                            # {window: limit} shared by every caller of the route
+    "cache_tags": [],                        # surrogate tags added to every entry cached on the route
+}
+
+WILDCARD = "*"
+
+def is_count(value) -> bool:
+    # bool is an int to Python, but "cache_ttl": true is a mistake, not a TTL of 1
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def is_positive_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+def validate_policy(path: str, policy: dict):
+    # checked when the table is compiled, so a wrong type is a 400 on publish and not a
+    # 500 on every request that hits the route
+    for name in ("cache_ttl", "max_body_size"):
+        if not is_count(policy[name]):
+            raise ValueError(f"Route '{path}': {name} must be a non-negative integer.")
+    if not is_positive_number(policy["timeout"]):
+        raise ValueError(f"Route '{path}': timeout must be a positive number of seconds.")
+    if policy["requests_per_minute"] is not None and not is_count(policy["requests_per_minute"]):
+        raise ValueError(f"Route '{path}': requests_per_minute must be a non-negative integer.")
+
+    if not isinstance(policy["quotas"], dict):
+        raise ValueError(f"Route '{path}': quotas must map windows to limits.")
+    unknown_windows = set(policy["quotas"]) - set(QUOTA_WINDOWS)
+    if unknown_windows:
+        raise ValueError(f"Route '{path}' has unknown quota windows: {', '.join(sorted(unknown_windows))}")
+    if not all(is_count(limit) for limit in policy["quotas"].values()):
+        raise ValueError(f"Route '{path}': quota limits must be non-negative integers.")
+
+    tags = policy["cache_tags"]
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError(f"Route '{path}': cache_tags must be a list of strings.")
+
+def validate_target(name: str, target: dict):
+    upstreams = target.get("upstreams")
+    if not upstreams:
+        raise ValueError(f"Target '{name}' has no upstreams.")
+    for item in [upstreams] if isinstance(upstreams, str) else upstreams:
+        if isinstance(item, dict):
+            url, weight = item.get("url"), item.get("weight", 1)
+        else:
+            url, weight = item, 1
+        if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+            raise ValueError(f"Target '{name}' has an upstream that isn't an http(s) URL: {url!r}")
+        if not is_count(weight) or weight == 0:
+            raise ValueError(f"Target '{name}': upstream weights must be positive integers.")
+
+    strategy = target.get("strategy")
+    if strategy is not None and strategy not in balancer.STRATEGIES:
+        raise ValueError(f"Target '{name}' has unknown strategy '{strategy}', use one of: {', '.join(balancer.STRATEGIES)}")
+    health_path = target.get("health_path")
+    if health_path is not None and (not isinstance(health_path, str) or not health_path.startswith("/")):
+        raise ValueError(f"Target '{name}': health_path must start with '/'.")
+    max_concurrency = target.get("max_concurrency")
+    if max_concurrency is not None and (not is_count(max_concurrency) or max_concurrency == 0):
+        raise ValueError(f"Target '{name}': max_concurrency must be a positive integer.")
+
+class Route:
+    def __init__(self, path: str, target: str, policy: dict, target_max_concurrency: int | None = None,
+                 policy_paths: dict | None = None):
+        self.path = path
+        self.target = target
+        self.target_max_concurrency = target_max_concurrency
+        self.cache_ttl = policy["cache_ttl"]
+        self.timeout = policy["timeout"]
+        self.max_body_size = policy["max_body_size"]
+        self.requests_per_minute = policy["requests_per_minute"]
+        self.quotas = policy["quotas"]
+        self.cache_tags = policy["cache_tags"]
+        self.policy = policy
+        # which route set each policy value, this one unless it was inherited
+        self.policy_paths = policy_paths or {}
+
+    def defined_at(self, setting: str) -> str:
+        return self.policy_paths.get(setting, self.path)
+
+    def to_dict(self) -> dict:
+        return {"path": self.path, "target": self.target, **self.policy}
+
+class RouteNode:
+    __slots__ = ("children", "wildcard", "route")
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.route = None
+
+def split_path(path: str) -> list[str]:
+    return [segment for segment in path.split("/") if segment]
+
+class RoutingTable:
+    def __init__(self, config: dict, source: str, version, previous_pools: dict | None = None):
+        self.config = config
+        self.source = source
+        self.version = version
+        self.root = RouteNode()
+        self.routes = []
+
+        targets = config.get("targets", {})
+        for name, target in targets.items():
+            validate_target(name, target)
+
+        # parents first, so every route can inherit from the one above it
+        route_specs = sorted(config.get("routes", []), key=lambda spec: len(split_path(spec["path"])))
+        for spec in route_specs:
+            self.add_route(spec, targets)
+
+        self.pools = balancer.build_pools(targets, previous_pools)
+
+    def add_route(self, spec: dict, targets: dict):
+        unknown = set(spec) - set(POLICY_DEFAULTS) - {"path", "target"}
+        if unknown:
+            raise ValueError(f"Route '{spec['path']}' has unknown settings: {', '.join(sorted(unknown))}")
+
+        segments = split_path(spec["path"])
+        if not segments or segments[0] == WILDCARD:
+            raise ValueError(f"Route '{spec['path']}' must start with an API name.")
+
+        parent = self.match_segments(segments)
+        policy = dict(parent.policy if parent else POLICY_DEFAULTS)
+        policy.update({key: value for key, value in spec.items() if key in POLICY_DEFAULTS})
+        path = "/".join(segments)
+        policy_paths = dict(parent.policy_paths if parent else {})
+        policy_paths.update({key: path for key in spec if key in POLICY_DEFAULTS})
+
+        validate_policy(spec["path"], policy)
+
+        target = spec.get("target") or (parent.target if parent else segments[0])
+        if target not in targets:
+            raise ValueError(f"Route '{spec['path']}' points at unknown target '{target}'.")
+
+        node = self.root
+        for segment in segments:
+            if segment == WILDCARD:
+                if node.wildcard is None:
+                    node.wildcard = RouteNode()
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(segment, RouteNode())
+
+        node.route = Route(path, target, policy, targets[target].get("max_concurrency"), policy_paths)
+        self.routes.append(node.route)
+
+    def match_segments(self, segments: list[str]) -> Route | None:
+        node = self.root
+        matched = None
+        for segment in segments:
+            node = node.children.get(segment) or node.wildcard
+            if node is None:
+                break
+            if node.route is not None:
+                matched = node.route
+        return matched
+
+    def match(self, api_name: str, path: str) -> Route | None:
+        return self.match_segments([api_name, *split_path(path)])
+
+def default_config() -> dict:
+    targets = {
+        api_name: {
+            "upstreams": upstreams,
+            "strategy": LOAD_BALANCING_STRATEGIES.get(api_name),
+            "health_path": HEALTH_CHECK_PATHS.get(api_name),
+            "max_concurrency": TARGET_MAX_CONCURRENCY.get(api_name),
+        }
+        for api_name, upstreams in API_TARGETS.items()
+    }
+    routes = [{"path": api_name} for api_name in API_TARGETS]
+    routes += [
+        {"path": f"{api_name}/{prefix}", "timeout": timeout}
+        for api_name, prefixes in ROUTE_TIMEOUTS.items()
+        for prefix, timeout in prefixes.items()
+    ]
+    return {"targets": targets, "routes": routes}
+
+def read_routes_file() -> tuple[dict, float] | None:
+    if not ROUTES_FILE or not os.path.exists(ROUTES_FILE):
+        return None
+    version = os.stat(ROUTES_FILE).st_mtime
+    with open(ROUTES_FILE) as f:
+        return json.load(f), version
+
+def initial_table() -> RoutingTable:
+    from_file = read_routes_file()
+    if from_file:
+        return RoutingTable(from_file[0], "file", from_file[1])
+    return RoutingTable(default_config(), "config", None)
+
+routing_table = initial_table()
+balancer.set_pools(routing_table.pools)
+
+def install(table: RoutingTable):
+    global routing_table
+    # both references change without an await in between, so no request sees a mix
+    routing_table = table
+    balancer.set_pools(table.pools)
+    logging.info(f"Routing table loaded from {table.source} (version {table.version}, {len(table.routes)} routes).")
+
+def get_route(api_name: str, path: str) -> Route | None:
+    return routing_table.match(api_name, path)
+
+async def reload_routes(force: bool = False):
+    if BACKEND == "memory":
+        # without Redis a table published through the API only lives in this process,
+        # it stays until a forced reload goes back to the file or config
+        if routing_table.source == "local" and not force:
+            return
+        redis_version = None
+    else:
+        redis_version = await redis_client.get(f"{ROUTES_REDIS_KEY}:version")
+    if redis_version is not None:
+        if not force and routing_table.source == "redis" and routing_table.version == redis_version:
+            return
+        config = json.loads(await redis_client.get(ROUTES_REDIS_KEY))
+        install(RoutingTable(config, "redis", redis_version, routing_table.pools))
+        return
+
+    if ROUTES_FILE and os.path.exists(ROUTES_FILE):
+        if not force and routing_table.source == "file" and routing_table.version == os.stat(ROUTES_FILE).st_mtime:
+            return
+        config, version = read_routes_file()
+        install(RoutingTable(config, "file", version, routing_table.pools))
+        return
+
+    if force or routing_table.source != "config":
+        install(RoutingTable(default_config(), "config", None, routing_table.pools))
+
+async def routing_watcher():
+    while True:
+        await asyncio.sleep(ROUTES_RELOAD_INTERVAL_SECONDS)
+        try:
+            await reload_routes()
+        except Exception as e:
+            # a broken table must never take the gateway down, keep serving the old one
+            logging.error(f"Failed to reload routing table, keeping version {routing_table.version}: {e}")
+
+@router.get("/")
+async def get_routes():
+    return {
+        "source": routing_table.source,
+        "version": routing_table.version,
+        "targets": routing_table.config.get("targets", {}),
+        "routes": [route.to_dict() for route in routing_table.routes],
+    }
+
+@router.put("/")
+async def publish_routes(config: dict = Body(...)):
+    # compile first, so a bad table is rejected before any worker can pick it up
+    try:
+        table = RoutingTable(config, "redis", None, routing_table.pools)
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid routing table: {e}")
+
+    if BACKEND == "memory":
+        table.source = "local"
+        table.version = str(int(routing_table.version or 0) + 1) if routing_table.source == "local" else "1"
+        install(table)
+        return {"version": table.version, "routes": len(table.routes)}
+
+    pipe = redis_client.pipeline()
+    pipe.set(ROUTES_REDIS_KEY, json.dumps(config))
+    pipe.incr(f"{ROUTES_REDIS_KEY}:version")
+    _, version = await pipe.execute()
+
+    # the other workers pick this up on their next poll, this one switches right away
+    table.version = str(version)
+    install(table)
+    return {"version": table.version, "routes": len(table.routes)}
+
+@router.post("/reload")
+async def force_reload_routes():
+    try:
+        await reload_routes(force=True)
+    except (ValueError, KeyError, TypeError, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid routing table: {e}")
+    return {"source": routing_table.source, "version": routing_table.version, "routes": len(routing_table.routes)}
@@ -1,13 +1,18 @@
+import asyncio
+import multiprocessing
 import secrets
+import hmac
 import bcrypt
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Tuple
 
 from fastapi import HTTPException, Depends, Header, status
-from sqlalchemy import select
+from sqlalchemy import select, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .models import APIKey
+from .config import ADMIN_API_TOKEN, DEFAULT_PRIORITY_TIER, KEY_HASHING_WORKERS
 from app.database import get_db
 
 def hash_secret(secret: str) -> str:
@@ -28,7 +33,8 @@ async def create_api_key(
     db: AsyncSession,
     user_id: str,
     requests_per_minute: int = 100,
-    expires_days: int = 30
+    expires_days: int = 30,
+    priority: str = DEFAULT_PRIORITY_TIER
 ) -> str:
     full_key, public_id, secret = generate_api_key()
     hashed_key = hash_secret(secret)
@@ -40,7 +46,8 @@ async def create_api_key(
         public_id=public_id,
         hashed_secret=hashed_key,
         requests_per_minute_limit=requests_per_minute,
-        expires_at=expires_at
+        expires_at=expires_at,
+        priority=priority
     )
 
     db.add(db_key)
@@ -49,6 +56,67 @@ async def create_api_key(
 
     return full_key
 
+# bcrypt is deliberately slow and holds a core while it runs, so bulk provisioning hashes
+# in separate processes (spawned, not forked from a process running an event loop)
+hashing_pool: ProcessPoolExecutor | None = None
+
+def get_hashing_pool() -> ProcessPoolExecutor:
+    global hashing_pool
+    if hashing_pool is None:
+        hashing_pool = ProcessPoolExecutor(
+            max_workers=KEY_HASHING_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return hashing_pool
+
+def shutdown_hashing_pool():
+    global hashing_pool
+    if hashing_pool is not None:
+        hashing_pool.shutdown(wait=False, cancel_futures=True)
+        hashing_pool = None
+
+def hash_secrets(plain_secrets: list[str]) -> list[str]:
+    return [hash_secret(secret) for secret in plain_secrets]
+
+async def hash_secrets_in_parallel(plain_secrets: list[str]) -> list[str]:
+    # one contiguous slice per worker keeps the pickling overhead to a task per process
+    loop = asyncio.get_running_loop()
+    pool = get_hashing_pool()
+    size = -(-len(plain_secrets) // KEY_HASHING_WORKERS)
+    slices = [plain_secrets[i:i + size] for i in range(0, len(plain_secrets), size)]
+    hashed = await asyncio.gather(*(loop.run_in_executor(pool, hash_secrets, part) for part in slices))
+    return [hashed_secret for part in hashed for hashed_secret in part]
+
+async def create_api_keys(db: AsyncSession, specs: list[dict]) -> list[dict]:
+    """Creates one key per spec (user_id, requests_per_minute, expires_days, priority) in a single INSERT."""
+    generated = [generate_api_key() for _ in specs]
+    hashed_secrets = await hash_secrets_in_parallel([secret for _, _, secret in generated])
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    created = []
+    for spec, (full_key, public_id, _), hashed_key in zip(specs, generated, hashed_secrets):
+        expires_at = now + timedelta(days=spec["expires_days"]) if spec["expires_days"] else None
+        rows.append({
+            "user_id": spec["user_id"],
+            "public_id": public_id,
+            "hashed_secret": hashed_key,
+            "requests_per_minute_limit": spec["requests_per_minute"],
+            "expires_at": expires_at,
+            "priority": spec["priority"],
+        })
+        created.append({
+            "api_key": full_key,
+            "user_id": spec["user_id"],
+            "requests_per_minute": spec["requests_per_minute"],
+            "expires_at": expires_at.isoformat() if expires_at else None,
+            "priority": spec["priority"],
+        })
+
+    await db.execute(insert(APIKey), rows)
+    await db.commit()
+    return created
+
 async def authenticate_api_key(
     authorization: str = Header(None),
     db: AsyncSession = Depends(get_db)
@@ -76,4 +144,16 @@ async def authenticate_api_key(
     if not verify_secret(plain_secret, db_key.hashed_secret):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key")
 
-    return db_key
\ No newline at end of file
+    return db_key
+
+async def require_admin_token(x_admin_token: str = Header(None)):
+    # closed unless a token is configured: these endpoints can repoint targets, purge the
+    # cache, export logs and mint keys, none of which should be open by accident
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin endpoints are disabled, set ADMIN_API_TOKEN to enable them."
+        )
+
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
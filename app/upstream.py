@@ -0,0 +1,52 @@
+from httpx import AsyncClient, Limits, Request
+
+from .config import UPSTREAM_MAX_CONNECTIONS, UPSTREAM_MAX_KEEPALIVE_CONNECTIONS
+
+# Helpers shared by everything that calls upstream targets: the proxy itself and the
+# cache refresher (see warming.py).
+
+# One client per worker for all proxied requests, so they reuse keep-alive connections
+# instead of paying a TCP (and TLS) handshake each time. Opened lazily, or up front by
+# the warm-up in lifecycle.py, and closed on shutdown.
+upstream_client: AsyncClient | None = None
+
+def get_upstream_client() -> AsyncClient:
+    global upstream_client
+    if upstream_client is None:
+        upstream_client = AsyncClient(limits=Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS
+        ))
+    return upstream_client
+
+async def close_upstream_client():
+    global upstream_client
+    if upstream_client is not None:
+        await upstream_client.aclose()
+        upstream_client = None
+
+async def send_raw(client: AsyncClient, upstream_request: Request):
+    response = await client.send(upstream_request, stream=True)
+    # read the raw bytes, httpx would otherwise decompress them for us
+    # and we'd have to compress them all over again
+    try:
+        content = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+    return response, content
+
+def strip_upstream_headers(headers) -> dict:
+    # remove hop-by-hop headers from the target's response
+    # this allows our server to generate correct headers for the client
+    response_headers = dict(headers)
+    response_headers.pop("content-encoding", None)
+    response_headers.pop("content-length", None)
+    response_headers.pop("transfer-encoding", None)
+    response_headers.pop("connection", None)
+
+    # I learned that X means experimental header, which are different from the standard ones
+    # Although it was depreceated in 2012, it's still widely used
+    response_headers.pop("x-ratelimit-limit", None)
+    response_headers.pop("x-ratelimit-remaining", None)
+    response_headers.pop("x-ratelimit-reset", None)
+    return response_headers
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+from collections import Counter
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException
+from httpx import AsyncClient
+
+from .balancer import get_pool
+from .cache import store, redis_client, make_cache_key, decode_cache_entry, set_cached_response
+from .compression import UPSTREAM_ACCEPT_ENCODING, compress_for_cache, is_supported
+from .config import (
+    BACKEND, CACHE_REFRESH_ENABLED, CACHE_REFRESH_INTERVAL_SECONDS, CACHE_REFRESH_AHEAD_SECONDS, CACHE_REFRESH_TOP_N,
+    CACHE_REFRESH_MIN_HITS, CACHE_REFRESH_PER_TARGET_PER_MINUTE, CACHE_HIT_DECAY_SECONDS, CACHE_PREWARM_URLS
+)
+from .invalidation import surrogate_tags
+from .rate_limit import Quota, check_quotas
+from .resilience import call_upstream
+from .routing import get_route
+from .upstream import send_raw, strip_upstream_headers
+
+# Refresh-ahead for hot cache entries.
+#
+# Without it the first request after a popular entry expires always waits for the upstream.
+# Instead, every worker counts cache hits in memory and adds them to a Redis sorted set
+# (HITS_KEY) once per cycle, so counting costs no extra round trip on the request path.
+# Each cycle we look at the CACHE_REFRESH_TOP_N hottest keys, check their remaining TTL,
+# and fetch the ones about to expire again in the background.
+#
+# Hit counts are halved every CACHE_HIT_DECAY_SECONDS, so keys that stop being popular
+# drop out instead of being refreshed forever. A short lock per key keeps workers from
+# refreshing the same entry twice, and refreshes share a per-target budget
+# (CACHE_REFRESH_PER_TARGET_PER_MINUTE) through the quota engine, so warming can never
+# turn into a load test against an upstream.
+#
+# Entries remember the request that produced them (api name, path, query), which is what
+# a refresh replays. Refreshes are anonymous: no client headers are forwarded.
+
+HITS_KEY = "cache_hits"
+MAX_TRACKED_KEYS = 10000
+
+# where the hit counts of all workers add up, in Redis or (BACKEND = "memory") in this process
+
+class RedisHitStore:
+    async def add(self, counts: dict):
+        pipe = redis_client.pipeline(transaction=False)
+        for cache_key, count in counts.items():
+            pipe.zincrby(HITS_KEY, count, cache_key)
+        await pipe.execute()
+
+    async def decay(self):
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zunionstore(HITS_KEY, {HITS_KEY: 0.5})
+        pipe.zremrangebyscore(HITS_KEY, "-inf", "(1")
+        pipe.zremrangebyrank(HITS_KEY, 0, -MAX_TRACKED_KEYS - 1)
+        await pipe.execute()
+
+    async def hottest(self, min_hits: int, count: int) -> list[str]:
+        return await redis_client.zrevrangebyscore(HITS_KEY, "+inf", min_hits, start=0, num=count)
+
+    async def forget(self, cache_keys: list[str]):
+        await redis_client.zrem(HITS_KEY, *cache_keys)
+
+class MemoryHitStore:
+    def __init__(self):
+        self.counts = Counter()
+
+    async def add(self, counts: dict):
+        self.counts.update(counts)
+
+    async def decay(self):
+        halved = {cache_key: count / 2 for cache_key, count in self.counts.most_common(MAX_TRACKED_KEYS)}
+        self.counts = Counter({cache_key: count for cache_key, count in halved.items() if count >= 1})
+
+    async def hottest(self, min_hits: int, count: int) -> list[str]:
+        return [cache_key for cache_key, hits in self.counts.most_common(count) if hits >= min_hits]
+
+    async def forget(self, cache_keys: list[str]):
+        for cache_key in cache_keys:
+            self.counts.pop(cache_key, None)
+
+hit_store = MemoryHitStore() if BACKEND == "memory" else RedisHitStore()
+
+hits = Counter()
+
+def count_hit(cache_key: str):
+    if CACHE_REFRESH_ENABLED:
+        hits[cache_key] += 1
+
+async def flush_hits():
+    if not hits:
+        return
+    # swapped out without an await, so hits counted meanwhile go into the next flush
+    pending = dict(hits)
+    hits.clear()
+    await hit_store.add(pending)
+
+async def decay_hits():
+    # whichever worker gets the lock does the decay for this period
+    if await store.acquire_lock(f"{HITS_KEY}:decay", CACHE_HIT_DECAY_SECONDS):
+        await hit_store.decay()
+
+async def find_expiring_keys() -> list[str]:
+    hot_keys = await hit_store.hottest(CACHE_REFRESH_MIN_HITS, CACHE_REFRESH_TOP_N)
+    if not hot_keys:
+        return []
+
+    ttls = await store.ttls_ms(hot_keys)
+
+    expiring, gone = [], []
+    for cache_key, ttl in zip(hot_keys, ttls):
+        if ttl == -2:
+            # already expired or purged, the next miss will cache it again
+            gone.append(cache_key)
+        elif 0 <= ttl <= CACHE_REFRESH_AHEAD_SECONDS * 1000:
+            expiring.append(cache_key)
+
+    if gone:
+        await hit_store.forget(gone)
+    return expiring
+
+async def refresh_entry(client: AsyncClient, cache_key: str, source: dict, budgeted: bool = True) -> bool:
+    api_name, path, params = source["api_name"], source["path"], source["params"]
+    route = get_route(api_name, path)
+    if route is None or route.cache_ttl <= 0:
+        return False
+
+    # held until it expires, by then the refreshed entry is no longer close to expiry
+    if not await store.acquire_lock(f"cache_refresh_lock:{cache_key}", int(route.timeout) + 1):
+        return False
+
+    try:
+        if budgeted:
+            await check_quotas([Quota("refresh", route.target, CACHE_REFRESH_PER_TARGET_PER_MINUTE, "minute")])
+
+        pool = get_pool(route.target)
+
+        async def send_to(base_url: str):
+            upstream_request = client.build_request(
+                method="GET",
+                url=f"{base_url}/{path}",
+                headers={"accept-encoding": UPSTREAM_ACCEPT_ENCODING},
+                params=params,
+                timeout=route.timeout
+            )
+            return await send_raw(client, upstream_request)
+
+        response, content = await call_upstream(route.target, "GET", route.timeout, lambda: pool.dispatch(send_to))
+    except HTTPException as e:
+        # out of budget, breaker open, upstream timing out: the entry just expires as usual
+        logging.debug(f"Skipped refreshing {cache_key}: {e.detail}")
+        return False
+
+    content_encoding = response.headers.get("content-encoding", "identity").strip().lower()
+    if response.status_code != 200 or not is_supported(content_encoding):
+        return False
+
+    response_headers = strip_upstream_headers(response.headers)
+    cache_tags = surrogate_tags(response_headers) + route.cache_tags
+    content, content_encoding = compress_for_cache(content, content_encoding, response_headers.get("content-type"))
+    await set_cached_response(cache_key, {
+        "status_code": response.status_code,
+        "headers": response_headers,
+        "encoding": content_encoding,
+        "body": content,
+        "source": source
+    }, route.cache_ttl, api_name, path, cache_tags)
+    return True
+
+async def refresh_expiring(client: AsyncClient):
+    cache_keys = await find_expiring_keys()
+    if not cache_keys:
+        return
+
+    refreshes = []
+    for cache_key, result in zip(cache_keys, await store.get_many(cache_keys)):
+        if result is None:
+            continue
+        entry = decode_cache_entry(result)
+        # entries cached before they carried their source can't be replayed
+        if entry.get("source") and entry["status_code"] == 200:
+            refreshes.append(refresh_entry(client, cache_key, entry["source"]))
+
+    refreshed = await asyncio.gather(*refreshes)
+    logging.info(f"Refreshed {sum(refreshed)} of {len(refreshes)} hot cache entries close to expiry.")
+
+def parse_prewarm_url(url: str) -> dict:
+    api_name, _, rest = url.strip("/").partition("/")
+    path, _, query = rest.partition("?")
+    return {"api_name": api_name, "path": path, "params": dict(parse_qsl(query))}
+
+async def prewarm_cache(client: AsyncClient):
+    for url in CACHE_PREWARM_URLS:
+        source = parse_prewarm_url(url)
+        cache_key = make_cache_key(source["api_name"], source["path"], source["params"])
+        try:
+            if await store.exists(cache_key):
+                continue
+            # the list is explicit configuration, so it doesn't count against the refresh budget
+            if not await refresh_entry(client, cache_key, source, budgeted=False):
+                logging.warning(f"Could not pre-warm {url}.")
+        except Exception as e:
+            logging.error(f"Failed to pre-warm {url}: {e}")
+
+async def cache_refresh_loop():
+    async with AsyncClient() as client:
+        await prewarm_cache(client)
+        if not CACHE_REFRESH_ENABLED:
+            return
+
+        while True:
+            await asyncio.sleep(CACHE_REFRESH_INTERVAL_SECONDS)
+            try:
+                await flush_hits()
+                await decay_hits()
+                await refresh_expiring(client)
+            except Exception as e:
+                logging.error(f"Cache refresh cycle failed: {e}")
@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Micro-benchmarks for the gateway's per-request hot path.
+#
+# Each component is called many times in isolation and we report:
+#   * ops/sec       - wall clock throughput of back-to-back calls
+#   * KiB/op        - peak transient memory allocated by a single call (tracemalloc)
+#   * blocks/op     - memory blocks still alive after the run, divided by the call count
+#   * loop lag      - how long the event loop was blocked, measured by a heartbeat task
+#                     that wakes up every millisecond and records how late it was
+#
+# By default everything runs in-process: Redis is replaced by fakeredis and the database
+# is a throwaway SQLite file, so the numbers are about our code and not the network.
+# Point --redis-url / --database-url at real services to include round trip costs, or
+# pass --backend memory to measure the single-node in-process stores instead.
+#
+#   python3 -m benchmarks.bench_components
+#   python3 -m benchmarks.bench_components --only rate_limit cache_get_hit --iterations 20000
+#   python3 -m benchmarks.bench_components --redis-url redis://localhost:6379 --json results.json
+
+HEARTBEAT_INTERVAL = 0.001
+
+class LoopLagMonitor:
+    def __init__(self):
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + HEARTBEAT_INTERVAL
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self.lags.append(max(loop.time() - expected, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+async def call(fn):
+    result = fn()
+    if asyncio.iscoroutine(result):
+        await result
+
+async def measure(name: str, fn, iterations: int) -> dict:
+    for _ in range(max(iterations // 10, 1)):
+        await call(fn)
+
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await call(fn)
+    elapsed = time.perf_counter() - start
+
+    # loop lag gets its own pass: we yield between calls like a real request would,
+    # otherwise purely synchronous components would never let the heartbeat run at all
+    sample_iterations = max(min(iterations // 10, 1000), 1)
+    monitor = LoopLagMonitor()
+    monitor.start()
+    await asyncio.sleep(0)
+    for _ in range(sample_iterations):
+        await call(fn)
+        await asyncio.sleep(0)
+    await asyncio.sleep(HEARTBEAT_INTERVAL * 2)
+    await monitor.stop()
+
+    # allocations, on a smaller sample since tracemalloc is expensive
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    peaks = []
+    for _ in range(sample_iterations):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await call(fn)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - current)
+    gc.collect()
+    retained = tracemalloc.take_snapshot().compare_to(baseline, "filename")
+    tracemalloc.stop()
+
+    lags = sorted(monitor.lags) or [0.0]
+    return {
+        "name": name,
+        "iterations": iterations,
+        "ops_per_sec": iterations / elapsed,
+        "us_per_op": elapsed / iterations * 1_000_000,
+        "kib_per_op": statistics.mean(peaks) / 1024,
+        "blocks_per_op": sum(stat.count_diff for stat in retained) / sample_iterations,
+        "max_loop_lag_ms": lags[-1] * 1000,
+        "p99_loop_lag_ms": lags[int((len(lags) - 1) * 0.99)] * 1000,
+    }
+
+def print_results(results: list):
+    header = f"{'benchmark':<24}{'ops/sec':>12}{'us/op':>10}{'KiB/op':>10}{'blocks/op':>11}{'max lag ms':>12}{'p99 lag ms':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['name']:<24}{r['ops_per_sec']:>12,.0f}{r['us_per_op']:>10.1f}{r['kib_per_op']:>10.2f}"
+            f"{r['blocks_per_op']:>11.2f}{r['max_loop_lag_ms']:>12.2f}{r['p99_loop_lag_ms']:>12.2f}"
+        )
+
+async def run(args):
+    # these imports read configuration at import time, so the environment has to be set first
+    from app import cache, rate_limit as rate_limit_module
+    from app.database import engine, AsyncSessionLocal
+    from app.models import Base
+    from app.security import create_api_key, authenticate_api_key
+    from app.config import LOG_FRAME_MAX_RECORDS
+    from app.log_records import LogFrame, decode_frame
+
+    if not args.redis_url:
+        try:
+            from fakeredis import FakeAsyncRedis, FakeServer
+        except ImportError:
+            raise SystemExit("fakeredis is not installed, run `pip install \"fakeredis[lua]\"` or pass --redis-url")
+        server = FakeServer()
+        cache.redis_client = FakeAsyncRedis(server=server, decode_responses=True)
+        cache.cache_client = FakeAsyncRedis(server=server)
+        rate_limit_module.redis_client = cache.redis_client
+
+        # quotas run as a Lua script, which fakeredis only supports with lupa installed
+        if args.backend == "redis":
+            try:
+                await cache.redis_client.eval("return 1", 0)
+            except Exception:
+                raise SystemExit(
+                    "fakeredis was installed without Lua support, run `pip install \"fakeredis[lua]\"` "
+                    "or pass --redis-url or --backend memory"
+                )
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with AsyncSessionLocal() as db:
+        # no expiry, SQLite hands back naive datetimes which can't be compared to aware ones
+        api_key = await create_api_key(db=db, user_id="bench-user", expires_days=0)
+
+    cache_key = cache.make_cache_key("mock_github", "users/bench", {"page": "1"})
+    cached_body = {
+        "status_code": 200,
+        "headers": {"content-type": "application/json; charset=utf-8", "etag": '"abc123"'},
+        "encoding": "identity",
+        "body": json.dumps({"login": "bench", "id": 12345, "bio": "x" * 512}).encode()
+    }
+    await cache.set_cached_response(cache_key, cached_body)
+
+    # a record as the proxy logs it: packed into the worker's current frame, finished when full
+    log_frame = LogFrame()
+    def encode_log():
+        nonlocal log_frame
+        log_frame.add(datetime.now(timezone.utc), "GET", "users/bench", 200, "bench-user", "miss")
+        if log_frame.count >= LOG_FRAME_MAX_RECORDS:
+            log_frame.finish()
+            log_frame = LogFrame()
+
+    full_frame = LogFrame()
+    for _ in range(LOG_FRAME_MAX_RECORDS):
+        full_frame.add(datetime.now(timezone.utc), "GET", "users/bench", 200, "bench-user", "miss")
+    full_frame = full_frame.finish()
+
+    async def authenticate():
+        async with AsyncSessionLocal() as db:
+            await authenticate_api_key(authorization=f"Bearer {api_key}", db=db)
+
+    benchmarks = {
+        "cache_key": (lambda: cache.make_cache_key("mock_github", "users/bench", {"page": "1", "per_page": "50"}), args.iterations),
+        "log_encode": (encode_log, args.iterations),
+        # one op is a whole frame, as the log writer decodes them
+        "log_decode_frame": (lambda: decode_frame(full_frame), max(args.iterations // LOG_FRAME_MAX_RECORDS, 10)),
+        "cache_set": (lambda: cache.set_cached_response(cache_key, cached_body), args.iterations),
+        "cache_get_hit": (lambda: cache.get_cached_response(cache_key), args.iterations),
+        "cache_get_miss": (lambda: cache.get_cached_response("cache:mock_github:missing:{}"), args.iterations),
+        "rate_limit": (lambda: rate_limit_module.rate_limit(key_id="bench-key", limit=10**9), args.iterations),
+        # bcrypt is deliberately slow, so it gets far fewer iterations
+        "authenticate_api_key": (authenticate, args.auth_iterations),
+    }
+
+    selected = args.only or list(benchmarks)
+    results = []
+    for name in selected:
+        fn, iterations = benchmarks[name]
+        results.append(await measure(name, fn, iterations))
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the Rexus hot path")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--auth-iterations", type=int, default=20)
+    parser.add_argument("--only", nargs="+", help="only run the named benchmarks")
+    parser.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    parser.add_argument("--backend", choices=["redis", "memory"], default="redis", help="which state backend to measure")
+    parser.add_argument("--database-url", help="use this database instead of a throwaway SQLite file")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{tmp}/bench.db"
+        if args.redis_url:
+            os.environ["REDIS_URL"] = args.redis_url
+        os.environ["REXUS_BACKEND"] = args.backend
+        asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,186 @@
-from fastapi import FastAPI, Request
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+from functools import lru_cache
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 
 app = FastAPI()
 
+# The mock server doubles as a configurable upstream simulator, so we can benchmark
+# the gateway's caching, streaming and resilience paths without hitting the real GitHub API.
+#
+# Every simulated route is driven by a "profile". Profiles come from three layers,
+# each one overriding the previous:
+#   1. DEFAULT_PROFILE below
+#   2. the JSON file pointed to by MOCK_SERVER_CONFIG (a "default" profile plus
+#      per-route profiles keyed by path prefix, longest prefix wins)
+#   3. query parameters on the request itself, e.g. /users/octocat?latency_ms=50&error_rate=0.1
+#
+# Example config file:
+#   {
+#     "default": {"latency_ms": 20, "latency_dist": "normal", "latency_jitter_ms": 5},
+#     "routes": {
+#       "/sim/large": {"size": 500000, "stream": true, "chunk_size": 16384, "max_age": 60},
+#       "/sim/flaky": {"error_rate": 0.2, "timeout_rate": 0.05}
+#     }
+#   }
+
+DEFAULT_PROFILE = {
+    "latency_ms": 0.0,          # mean latency before the first byte
+    "latency_dist": "fixed",    # fixed | uniform | normal | exponential | lognormal
+    "latency_jitter_ms": 0.0,   # spread for uniform/normal/lognormal
+    "size": 0,                  # minimum payload size in bytes (padded JSON)
+    "stream": False,            # send the body with chunked transfer encoding
+    "chunk_size": 8192,
+    "chunk_delay_ms": 0.0,      # pause between chunks when streaming
+    "error_rate": 0.0,          # fraction of requests that fail with error_status
+    "error_status": 503,
+    "timeout_rate": 0.0,        # fraction of requests that hang for timeout_seconds
+    "timeout_seconds": 30.0,
+    "etag": True,               # send an ETag and honour If-None-Match with a 304
+    "max_age": None,            # Cache-Control max-age, omitted when None
+    "surrogate_key": "",        # space separated Surrogate-Key tags, omitted when empty
+}
+
+def load_config(path: str | None) -> dict:
+    if not path:
+        return {"default": {}, "routes": {}}
+    with open(path) as f:
+        config = json.load(f)
+    config.setdefault("default", {})
+    config.setdefault("routes", {})
+    return config
+
+CONFIG = load_config(os.getenv("MOCK_SERVER_CONFIG"))
+
+# sorted once so that the first match is always the longest prefix
+ROUTE_PREFIXES = sorted(CONFIG["routes"], key=len, reverse=True)
+
+def coerce(value: str, default):
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float) or default is None:
+        return float(value)
+    return value
+
+def resolve_profile(path: str, query_params) -> dict:
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(CONFIG["default"])
+
+    for prefix in ROUTE_PREFIXES:
+        if path.startswith(prefix):
+            profile.update(CONFIG["routes"][prefix])
+            break
+
+    for name, value in query_params.items():
+        if name in DEFAULT_PROFILE:
+            try:
+                profile[name] = coerce(value, DEFAULT_PROFILE[name])
+            except ValueError:
+                # a 4xx, so a typo in a benchmark's URL doesn't read as simulated upstream errors
+                raise HTTPException(status_code=400, detail=f"Invalid value for {name}: {value!r}")
+
+    return profile
+
+def sample_latency(profile: dict) -> float:
+    mean = profile["latency_ms"]
+    jitter = profile["latency_jitter_ms"]
+    dist = profile["latency_dist"]
+
+    if dist == "uniform":
+        latency = random.uniform(mean - jitter, mean + jitter)
+    elif dist == "normal":
+        latency = random.gauss(mean, jitter)
+    elif dist == "exponential":
+        latency = random.expovariate(1 / mean) if mean > 0 else 0.0
+    elif dist == "lognormal":
+        # pick mu/sigma so the distribution's median is the configured mean,
+        # which gives the long right tail real APIs tend to have
+        sigma = jitter / mean if mean > 0 else 0.0
+        latency = mean * random.lognormvariate(0, sigma)
+    else:
+        latency = mean
+
+    return max(latency, 0.0) / 1000
+
+@lru_cache(maxsize=256)
+def build_payload(base_body: str, size: int) -> tuple[bytes, str]:
+    # payloads are deterministic per (body, size) so ETags stay stable across requests
+    body = json.loads(base_body)
+    encoded = json.dumps(body).encode()
+
+    if size > len(encoded):
+        padding_needed = size - len(encoded) - len(', "padding": ""')
+        body["padding"] = "x" * max(padding_needed, 0)
+        encoded = json.dumps(body).encode()
+
+    etag = '"' + hashlib.sha1(encoded).hexdigest() + '"'
+    return encoded, etag
+
+async def stream_body(body: bytes, chunk_size: int, chunk_delay: float):
+    for start in range(0, len(body), chunk_size):
+        yield body[start:start + chunk_size]
+        if chunk_delay:
+            await asyncio.sleep(chunk_delay)
+
+async def simulate(path: str, request: Request, body: dict | None = None) -> Response:
+    profile = resolve_profile(path, request.query_params)
+    logging.debug(f"Mock server simulating {path} with profile {profile}")
+
+    latency = sample_latency(profile)
+    if latency:
+        await asyncio.sleep(latency)
+
+    roll = random.random()
+    if roll < profile["timeout_rate"]:
+        await asyncio.sleep(profile["timeout_seconds"])
+        return Response(status_code=504)
+    if roll < profile["timeout_rate"] + profile["error_rate"]:
+        return Response(
+            content=json.dumps({"message": "Simulated upstream error"}),
+            status_code=profile["error_status"],
+            media_type="application/json"
+        )
+
+    if body is None:
+        body = {"path": path, "id": 12345, "mock": True}
+    payload, etag = build_payload(json.dumps(body), profile["size"])
+
+    headers = {}
+    if profile["etag"]:
+        headers["ETag"] = etag
+    if profile["max_age"] is not None:
+        headers["Cache-Control"] = f"public, max-age={int(profile['max_age'])}"
+    if profile["surrogate_key"]:
+        headers["Surrogate-Key"] = profile["surrogate_key"]
+
+    if profile["etag"] and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    if profile["stream"]:
+        return StreamingResponse(
+            stream_body(payload, profile["chunk_size"], profile["chunk_delay_ms"] / 1000),
+            media_type="application/json",
+            headers=headers
+        )
+
+    return Response(content=payload, media_type="application/json", headers=headers)
+
 @app.api_route("/users/{username}", methods=["GET"])
 async def get_user(username: str, request: Request):
-    print(f"Mock server received request for user: {username}")
-    return {"login": username, "id": 12345, "mock": True}
+    return await simulate(f"/users/{username}", request, {"login": username, "id": 12345, "mock": True})
+
+# generic synthetic route, payload shape is driven entirely by the profile
+@app.api_route("/sim/{name:path}", methods=["GET"])
+async def get_simulated(name: str, request: Request):
+    return await simulate(f"/sim/{name}", request)
 
-# To run this server: uvicorn mock_server:app --port 8001
\ No newline at end of file
+# To run this server: uvicorn mock_server:app --port 8001
+# With a config file: MOCK_SERVER_CONFIG=mock_config.json uvicorn mock_server:app --port 8001
@@ -1,9 +1,15 @@
 import httpx
 import asyncio
+import os
 
 BASE_URL = "http://localhost:8000"
 AUTH_URL = f"{BASE_URL}/auth/keys"
 PROXY_URL = f"{BASE_URL}/proxy/mock_github/users/testuser"
+ROUTES_URL = f"{BASE_URL}/routes/"
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+# a table that would send every mock_github request (and its Authorization header) elsewhere
+HIJACK_TABLE = {"targets": {"mock_github": {"upstreams": ["http://attacker.invalid"]}}, "routes": [{"path": "mock_github"}]}
 
 valid_api_key = None
 
@@ -67,6 +73,32 @@ async def test_proxy_access_valid_key():
     assert response.status_code == 200, f"Expected 200, got {response.status_code}"
     print("Test PASSED: Request was successfully authorized.")
     
+async def test_admin_endpoint_missing_token():
+    print("\n--- Running Test: Admin Endpoint without Token ---")
+
+    # also what every caller gets while the gateway has no ADMIN_API_TOKEN configured
+    async with httpx.AsyncClient() as client:
+        response = await client.put(ROUTES_URL, json=HIJACK_TABLE)
+
+    assert response.status_code == 403, f"Expected 403, got {response.status_code}"
+    print("Test PASSED: Routing table could not be replaced without a token.")
+
+async def test_admin_endpoint_wrong_token():
+    print("\n--- Running Test: Admin Endpoint with Wrong Token ---")
+
+    headers = {"X-Admin-Token": f"not-{ADMIN_API_TOKEN or 'the-token'}"}
+    async with httpx.AsyncClient() as client:
+        response = await client.put(ROUTES_URL, json=HIJACK_TABLE, headers=headers)
+        assert response.status_code == 403, f"Expected 403, got {response.status_code}"
+
+        if ADMIN_API_TOKEN:
+            response = await client.get(ROUTES_URL, headers={"X-Admin-Token": ADMIN_API_TOKEN})
+            assert response.status_code == 200, f"Expected 200 with the real token, got {response.status_code}"
+            upstreams = response.json()["targets"]["mock_github"]["upstreams"]
+            assert "http://attacker.invalid" not in str(upstreams), "Routing table was replaced"
+
+    print("Test PASSED: Routing table could not be replaced with a wrong token.")
+
 async def main():
     print("========================")
     print("  Running Auth Tests  ")
@@ -78,6 +110,8 @@ async def main():
         await test_proxy_access_bad_key_format()
         await test_proxy_access_invalid_key()
         await test_proxy_access_valid_key()
+        await test_admin_endpoint_missing_token()
+        await test_admin_endpoint_wrong_token()
         print("\n=========================")
         print("  All tests completed.  ")
         print("=========================")
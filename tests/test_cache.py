@@ -1,12 +1,15 @@
 import httpx
 import asyncio
 import json
+import os
 import redis.asyncio as redis
 from app.config import CACHE_EXPIRY_SECONDS
 
 BASE_URL = "http://localhost:8000/proxy/mock_github"
 REDIS_URL = "redis://localhost:6379"
 AUTH_URL = "http://localhost:8000/auth/keys"
+PURGE_URL = "http://localhost:8000/cache/purge"
+ADMIN_HEADERS = {"X-Admin-Token": os.getenv("ADMIN_API_TOKEN", "")}
 
 
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
@@ -106,6 +109,79 @@ async def test_cache_bypassed_for_post_request(headers: dict):
     print("Test PASSED: POST request did not populate the cache.")
 
 
+async def test_large_response_stored_compressed(headers: dict):
+    print("\n--- Running Test: Large Response Stored Compressed ---")
+    await redis_client.flushdb()
+
+    # the mock server pads the JSON body up to the requested size
+    test_path = "/sim/large"
+    url = f"{BASE_URL}{test_path}?size=50000"
+    cache_key = create_cache_key("sim/large", {"size": "50000"})
+
+    async with httpx.AsyncClient() as client:
+        response = await client.get(url, headers={**headers, "Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers.get("content-encoding") == "gzip"
+    assert len(response.content) == 50000
+
+    stored_size = await redis_client.strlen(cache_key)
+    assert 0 < stored_size < 50000
+
+    async with httpx.AsyncClient() as client:
+        response = await client.get(url, headers={**headers, "Accept-Encoding": "identity"})
+
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert len(response.content) == 50000
+
+    print("Test PASSED: Large response was cached compressed and served to both kinds of client.")
+
+
+async def test_purge_by_tag_and_prefix(headers: dict):
+    print("\n--- Running Test: Purge by Tag and Prefix ---")
+    await redis_client.flushdb()
+
+    tagged_key = create_cache_key("sim/purge/tagged", {"surrogate_key": "team-a"})
+    other_key = create_cache_key("sim/purge/other")
+
+    async with httpx.AsyncClient() as client:
+        await client.get(f"{BASE_URL}/sim/purge/tagged?surrogate_key=team-a", headers=headers)
+        await client.get(f"{BASE_URL}/sim/purge/other", headers=headers)
+
+        response = await client.post(f"{PURGE_URL}/tags", json={"tags": ["team-a"]}, headers=ADMIN_HEADERS)
+        assert response.json()["purged"] == 1
+        assert await redis_client.exists(tagged_key) == 0
+        assert await redis_client.exists(other_key) == 1
+
+        response = await client.post(f"{PURGE_URL}/prefix", json={"api_name": "mock_github", "path_prefix": "sim/purge"}, headers=ADMIN_HEADERS)
+        assert response.json()["purged"] == 1
+        assert await redis_client.exists(other_key) == 0
+
+    print("Test PASSED: Entries were purged by surrogate tag and by path prefix.")
+
+
+async def test_purge_by_key_only_touches_cache_keys(headers: dict):
+    print("\n--- Running Test: Purge by Key Only Touches Cache Keys ---")
+    await redis_client.flushdb()
+
+    cache_key = create_cache_key("sim/purge/key")
+    await redis_client.set("leader:log_writer", "someone-else")
+
+    async with httpx.AsyncClient() as client:
+        await client.get(f"{BASE_URL}/sim/purge/key", headers=headers)
+
+        response = await client.post(f"{PURGE_URL}/key", json={"key": "leader:log_writer"}, headers=ADMIN_HEADERS)
+        assert response.status_code == 400, f"Expected 400 for a non-cache key, got {response.status_code}"
+        assert await redis_client.exists("leader:log_writer") == 1, "A non-cache key was deleted"
+
+        response = await client.post(f"{PURGE_URL}/key", json={"key": cache_key}, headers=ADMIN_HEADERS)
+        assert response.json()["purged"] == 1
+        assert await redis_client.exists(cache_key) == 0
+
+    print("Test PASSED: Cache keys were purged and other keys were refused.")
+
+
 async def test_cache_expiration(headers: dict):
     print("\n--- Running Test: Cache Expiration ---")
     if CACHE_EXPIRY_SECONDS != 1:
@@ -141,6 +217,9 @@ async def main():
         await test_cache_hit(headers)
         await test_cache_bypassed_for_different_params(headers)
         await test_cache_bypassed_for_post_request(headers)
+        await test_large_response_stored_compressed(headers)
+        await test_purge_by_tag_and_prefix(headers)
+        await test_purge_by_key_only_touches_cache_keys(headers)
         await test_cache_expiration(headers)
         print("\n=========================")
         print("  All tests completed.   ")